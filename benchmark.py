@@ -0,0 +1,600 @@
+"""Load-test harness: runs the real bot handlers against in-process Drive v3 and Telegram stand-ins.
+
+    python benchmark.py                             # every scenario, JSON on stdout
+    python benchmark.py -s page_burst -o new.json   # one scenario, saved for later comparison
+    python benchmark.py --set drive_latency=0.2     # override a parameter in every scenario
+    python benchmark.py --compare old.json new.json
+    python benchmark.py --replay updates.jsonl http://localhost:8080/telegram   # webhook mode, recorded updates
+
+Each scenario runs in a fresh interpreter so caches, the store and peak RSS never leak between them.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MB = 1024 * 1024
+
+# --- SCENARIOS ---
+DEFAULTS = {
+    "users": 100,
+    "drive_latency": 0.05,       # seconds per Drive request
+    "drive_bandwidth": 50,       # MB/s per Drive connection, 0 = unlimited
+    "telegram_latency": 0.05,    # seconds per Bot API call
+    "telegram_bandwidth": 100,   # MB/s per upload, 0 = unlimited
+    "folder_files": 300,         # files directly in every folder
+    "subfolders": 5,             # folders directly in every folder
+    "depth": 2,                  # folder levels below the root
+    "file_size": 2 * MB,
+    "export_size": 1 * MB,       # bytes a Google Doc exports to
+    "pages": 5,                  # pages each user flips through
+    "local_api": 0,              # 1 = run as if behind a local Bot API server (uploads by file path)
+}
+
+SCENARIOS = {
+    "start_burst": {"action": "start"},
+    "page_burst": {"action": "page"},
+    "open_subfolders": {"action": "open", "users": 50},
+    "search_drive": {"action": "search", "users": 50},
+    "search_indexed": {"action": "search_indexed"},
+    "download_90mb": {"action": "download", "users": 20, "file_size": 90 * MB},
+    "download_same_file": {"action": "download_same", "users": 20, "file_size": 90 * MB},
+    "cache_hits": {"action": "cache_hit"},
+    "download_folder": {"action": "zip", "users": 10, "folder_files": 40},
+    "download_local_api": {"action": "download", "users": 20, "file_size": 90 * MB, "local_api": 1},
+}
+
+# Numbers --compare reports, and whether a bigger value is better
+COMPARED = {"throughput": True, "p50_ms": False, "p99_ms": False, "peak_rss_mb": False,
+            "drive_calls_per_action": False, "telegram_calls_per_action": False}
+
+# --- FAKE DRIVE ---
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+DOC_MIME = 'application/vnd.google-apps.document'
+WORDS = ("Chapter", "Lesson", "Physics", "Mechanics", "Waves", "Optics", "Exam", "Notes", "Revision", "Solutions")
+
+class FakeDrive:
+    """A generated folder tree served with fixed per-request latency and per-connection bandwidth"""
+    def __init__(self, root_id, params):
+        self.latency = params["drive_latency"]
+        self.bandwidth = params["drive_bandwidth"] * MB
+        self.export_size = params["export_size"]
+        self.children = {}
+        self.files = {}
+        self.pattern = os.urandom(8 * MB)
+        self.doubled = self.pattern * 2
+        self._grow(root_id, params, params["depth"])
+
+    def _grow(self, folder_id, params, depth):
+        kids = self.children[folder_id] = []
+        for i in range(params["folder_files"]):
+            fid = f"{folder_id}.{i}"
+            doc = i % 50 == 49
+            meta = {
+                "id": fid, "name": f"{WORDS[i % len(WORDS)]} {i} - {WORDS[(i // 10) % len(WORDS)]}" + ("" if doc else ".pdf"),
+                "mimeType": DOC_MIME if doc else "application/pdf", "parents": [folder_id],
+                "modifiedTime": "2024-01-01T00:00:00.000Z", "md5Checksum": f"md5-{fid}",
+                "webViewLink": f"https://drive.example/{fid}",
+            }
+            if not doc: meta["size"] = str(params["file_size"])
+            kids.append(meta)
+            self.files[fid] = meta
+        if depth <= 0: return
+        for i in range(params["subfolders"]):
+            sub = f"{folder_id}-d{i}"
+            meta = {"id": sub, "name": f"Folder {WORDS[i % len(WORDS)]} {i}", "mimeType": FOLDER_MIME, "parents": [folder_id]}
+            kids.append(meta)
+            self.files[sub] = meta
+            self._grow(sub, params, depth - 1)
+
+    def wait(self, nbytes=0):
+        time.sleep(self.latency + (nbytes / self.bandwidth if self.bandwidth else 0))
+
+    def list(self, q, page_size, page_token):
+        match = re.search(r"'(.+?)' in parents", q)
+        if match:
+            items = self.children.get(match.group(1), [])
+        else:
+            needle = re.search(r"name contains '(.+?)'", q).group(1).lower()
+            items = [f for f in self.files.values() if needle in f["name"].lower()]
+        start = int(page_token or 0)
+        res = {"files": [dict(f) for f in items[start:start + page_size]]}
+        if start + page_size < len(items): res["nextPageToken"] = str(start + page_size)
+        return res
+
+    def content(self, file_id, start, end):
+        """Bytes start..end inclusive, clipped to the file; returns (data, total_size)"""
+        meta = self.files[file_id]
+        total = int(meta["size"]) if "size" in meta else self.export_size
+        end = min(end, total - 1)
+        length = max(0, end - start + 1)
+        self.wait(length)
+        return self.bytes_at(file_id, start, length), total
+
+    def bytes_at(self, file_id, start, length):
+        """Bytes depend on the file and the offset, so a range written in the wrong place changes the checksum"""
+        size = len(self.pattern)
+        offset = (start + zlib.crc32(file_id.encode())) % size
+        # One slice (one copy) for any range up to the pattern size, like the old fixed-prefix reads
+        if length <= size: return self.doubled[offset:offset + length]
+        block = self.pattern
+        parts = []
+        while length > 0:
+            piece = block[offset:offset + length]
+            parts.append(piece)
+            length -= len(piece)
+            offset = 0
+        return b"".join(parts)
+
+    def md5(self, file_id):
+        """What a correct download of file_id hashes to"""
+        meta = self.files[file_id]
+        total = int(meta["size"]) if "size" in meta else self.export_size
+        digest = hashlib.md5()
+        for start in range(0, total, len(self.pattern)):
+            digest.update(self.bytes_at(file_id, start, min(len(self.pattern), total - start)))
+        return digest.hexdigest()
+
+class FakeRequest:
+    def __init__(self, drive, fn):
+        self.drive = drive
+        self.fn = fn
+
+    def execute(self):
+        self.drive.wait()
+        return self.fn()
+
+class FakeMediaRequest:
+    """Stands in for get_media/export_media: execute() honours a Range header, and
+    MediaIoBaseDownload drives it through http.request() like the real client"""
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+        self.uri = f"fake://drive/{file_id}"
+        self.headers = {}
+        self.http = FakeHttp(drive)
+
+    def execute(self):
+        start, end = parse_range(self.headers.get('Range'))
+        return self.drive.content(self.file_id, start, end)[0]
+
+class FakeResponse(dict):
+    def __init__(self, status, headers):
+        super().__init__(headers)
+        self.status = status
+
+class FakeHttp:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        start, end = parse_range(headers.get('range'))
+        data, total = self.drive.content(uri.rsplit("/", 1)[1], start, end)
+        return FakeResponse(206, {"content-range": f"bytes {start}-{start + len(data) - 1}/{total}"}), data
+
+def parse_range(header):
+    if not header: return 0, float('inf')
+    start, end = header.split("=", 1)[1].split("-")
+    return int(start), int(end)
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        # One round trip for the whole batch, like Drive's multipart endpoint
+        self.drive.wait()
+        for rid, req in self.requests:
+            self.callback(rid, req.fn(), None)
+
+class FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q, pageSize=100, pageToken=None, **kwargs):
+        return FakeRequest(self.drive, lambda: self.drive.list(q, pageSize, pageToken))
+
+    def get(self, fileId, fields=None):
+        return FakeRequest(self.drive, lambda: dict(self.drive.files[fileId]))
+
+    def get_media(self, fileId):
+        return FakeMediaRequest(self.drive, fileId)
+
+    def export_media(self, fileId, mimeType):
+        return FakeMediaRequest(self.drive, fileId)
+
+class FakeService:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def files(self):
+        return FakeFiles(self.drive)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self.drive, callback)
+
+class FakeDrivePool:
+    """Drop-in for bot.drive_pool"""
+    def __init__(self, drive):
+        self.drive = drive
+
+    def get(self):
+        return FakeService(self.drive)
+
+    def new_http(self):
+        return FakeHttp(self.drive)
+
+    def stats(self):
+        return {}
+
+# --- FAKE TELEGRAM ---
+class FakeTelegram:
+    """Bot API stand-in: every call costs the configured latency; uploads read the whole stream"""
+    def __init__(self, params):
+        self.latency = params["telegram_latency"]
+        self.bandwidth = params["telegram_bandwidth"] * MB
+        self.calls = {}
+        self.uploaded = 0
+        self.digests = []   # md5 of every uploaded file, or of every entry of an uploaded ZIP
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+
+    async def call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    def drain(self, fh, name, paced=True):
+        """Reads an upload like the Bot API would; returns its size and records its checksums"""
+        read = 0
+        digest = hashlib.md5()
+        copy = tempfile.TemporaryFile() if name.endswith(".zip") else None
+        while True:
+            chunk = fh.read(MB)
+            if not chunk: break
+            read += len(chunk)
+            digest.update(chunk)
+            if copy: copy.write(chunk)
+            if paced and self.bandwidth: time.sleep(len(chunk) / self.bandwidth)
+        if copy is None:
+            self.digests.append(digest.hexdigest())
+            return read
+        with copy, zipfile.ZipFile(copy) as zf:
+            for info in zf.infolist():
+                with zf.open(info) as entry:
+                    self.digests.append(hashlib.md5(entry.read()).hexdigest())
+        return read
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self.call('sendDocument')
+        if not isinstance(document, str):
+            if isinstance(document, os.PathLike):
+                # local mode: the server reads the file itself
+                with open(document, 'rb') as fh:
+                    size = await asyncio.to_thread(self.drain, fh, os.fspath(document), False)
+            else:
+                content = getattr(document, 'input_file_content', document)
+                if isinstance(content, bytes): content = io.BytesIO(content)
+                size = await asyncio.to_thread(self.drain, content, getattr(document, 'filename', None) or "")
+            self.uploaded += size
+        sent = FakeMessage(self, chat_id)
+        sent.document = SimpleNamespace(file_id=document if isinstance(document, str) else f"tg-{next(self.file_ids)}")
+        return sent
+
+class FakeMessage:
+    def __init__(self, tg, chat_id):
+        self.tg = tg
+        self.chat_id = chat_id
+        self.message_id = next(tg.message_ids)
+        self.document = None
+
+    async def reply_text(self, text, **kwargs):
+        await self.tg.call('sendMessage')
+        return FakeMessage(self.tg, self.chat_id)
+
+    async def edit_text(self, text, **kwargs):
+        await self.tg.call('editMessageText')
+        return self
+
+    async def delete(self):
+        await self.tg.call('deleteMessage')
+        return True
+
+    async def reply_document(self, document, **kwargs):
+        return await self.tg.send_document(self.chat_id, document, **kwargs)
+
+class FakeQuery:
+    def __init__(self, tg, user, data):
+        self.tg = tg
+        self.data = data
+        self.from_user = user
+        self.message = FakeMessage(tg, user.id)
+
+    async def answer(self, *args, **kwargs):
+        await self.tg.call('answerCallbackQuery')
+
+def make_update(tg, user_id, data=None):
+    user = SimpleNamespace(id=user_id, language_code='en')
+    return SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=user_id),
+                           message=FakeMessage(tg, user_id),
+                           callback_query=FakeQuery(tg, user, data) if data else None)
+
+# --- RUNNER ---
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+def drive_calls(bot):
+    by_op = {}
+    for (op, _outcome), n in dict(bot.DRIVE_CALLS.values).items():
+        by_op[op] = by_op.get(op, 0) + n
+    return by_op
+
+def diff_counts(after, before):
+    return {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+
+async def run_scenario(bot, params):
+    tg = FakeTelegram(params)
+    drive = FakeDrive(bot.ROOT_FOLDER_ID, params)
+    bot.creds = True
+    bot.drive_pool = FakeDrivePool(drive)
+    bot.progress_reporter.start()
+    resident = set(bot.background_tasks)
+    action = params["action"]
+    root_files = [f for f in drive.children[bot.ROOT_FOLDER_ID] if f["mimeType"] != FOLDER_MIME]
+    subfolders = [fid for fid in drive.children if fid != bot.ROOT_FOLDER_ID]
+
+    # Untimed setup
+    if action == "search_indexed":
+        await bot.crawl_drive_tree()
+    if action == "cache_hit":
+        bot.cache_file_id(root_files[0]["id"], "tg-cached", root_files[0])
+
+    def steps(user):
+        if action == "start":
+            return [("start", None)]
+        if action == "page":
+            return [("start", None)] + [("btn", f"PAGE|{bot.ROOT_FOLDER_ID}|{p}") for p in range(1, params["pages"])]
+        if action == "open":
+            return [("btn", f"OPEN|{subfolders[user % len(subfolders)]}")]
+        if action in ("search", "search_indexed"):
+            return [("search", [WORDS[user % len(WORDS)].lower()])]
+        if action == "download":
+            return [("download", root_files[user % len(root_files)]["id"])]
+        if action == "zip":
+            return [("zip", subfolders[user % len(subfolders)])]
+        return [("download", root_files[0]["id"])]
+
+    # Files whose bytes the uploads must reproduce exactly
+    users = range(params["users"])
+    if action == "download": targets = {root_files[u % len(root_files)]["id"] for u in users}
+    elif action == "download_same": targets = {root_files[0]["id"]}
+    elif action == "zip":
+        targets = {f["id"] for fid in {subfolders[u % len(subfolders)] for u in users}
+                   for f in drive.children[fid] if f["mimeType"] != FOLDER_MIME}
+    else: targets = set()
+
+    latencies = []
+    errors = 0
+
+    async def session(user):
+        nonlocal errors
+        for kind, arg in steps(user):
+            started = time.perf_counter()
+            try:
+                if kind == "start":
+                    await bot.start(make_update(tg, user), SimpleNamespace(args=[]))
+                elif kind == "search":
+                    await bot.search(make_update(tg, user), SimpleNamespace(args=arg))
+                elif kind == "btn":
+                    await bot.btn(make_update(tg, user, arg), SimpleNamespace(args=[]))
+                elif kind == "zip":
+                    await bot.handle_folder_download(make_update(tg, user, f"ZIP|{arg}"), arg)
+                else:
+                    await bot.handle_download(make_update(tg, user, f"DL|{arg}"), arg)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    drive_before = drive_calls(bot)
+    rss_before = bot.process_rss()
+    started = time.perf_counter()
+    await asyncio.gather(*(session(u) for u in range(params["users"])))
+    elapsed = time.perf_counter() - started
+    # Let follow-up work (streamed pages, cache validation) land so it is counted against this run
+    follow_up = bot.background_tasks - resident
+    if follow_up: await asyncio.wait(follow_up, timeout=60)
+
+    drive_ops = diff_counts(drive_calls(bot), drive_before)
+    # Every upload must remove its folder from the directory shared with the Bot API server
+    spool_leftovers = len(os.listdir(bot.LOCAL_BOT_API_DIR)) if bot.LOCAL_BOT_API_DIR else 0
+    expected = {drive.md5(fid) for fid in targets}
+    mismatches = sum(1 for digest in tg.digests if digest not in expected)
+    latencies.sort()
+    actions = len(latencies)
+    return {
+        "params": params,
+        "actions": actions,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(actions / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "rss_before_mb": round(rss_before / MB, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "drive_calls": drive_ops,
+        "drive_calls_per_action": round(sum(drive_ops.values()) / actions, 3) if actions else 0.0,
+        "telegram_calls": dict(tg.calls),
+        "telegram_calls_per_action": round(sum(tg.calls.values()) / actions, 3) if actions else 0.0,
+        "uploaded_mb": round(tg.uploaded / MB, 1),
+        "checksum_mismatches": mismatches,
+        "spool_leftovers": spool_leftovers,
+    }
+
+def run_child(name, params):
+    """Runs one scenario in this (fresh) interpreter inside a throwaway working directory"""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    os.environ["STORE_FILE"] = os.path.join(workdir, "bot.db")
+    os.environ["SPOOL_DIR"] = workdir
+    os.environ["BROADCAST_ON_START"] = "0"
+    os.environ.pop("GOOGLE_CREDENTIALS", None)
+    if params["local_api"]:
+        # Only the env matters: uploads still go to FakeTelegram, which reads the path it is given
+        os.environ["LOCAL_BOT_API_URL"] = "http://localhost:8081"
+        os.environ["LOCAL_BOT_API_DIR"] = os.path.join(workdir, "api")
+        os.makedirs(os.environ["LOCAL_BOT_API_DIR"])
+    else:
+        os.environ.pop("LOCAL_BOT_API_URL", None)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.WARNING)
+    import bot
+    bot.start_boot()
+    bot.boot_future.result()
+
+    async def main():
+        try:
+            return await run_scenario(bot, params)
+        finally:
+            for task in list(bot.background_tasks): task.cancel()
+
+    result = asyncio.run(main())
+    bot.store.close()
+    print(json.dumps(result))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs:
+        key, value = pair.split("=", 1)
+        if key not in DEFAULTS: raise SystemExit(f"unknown parameter: {key}")
+        overrides[key] = int(float(value)) if isinstance(DEFAULTS[key], int) else float(value)
+    return overrides
+
+def compare(old_path, new_path):
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    print(f"{'scenario':<20} {'metric':<26} {old.get('commit') or 'old':>10} {new.get('commit') or 'new':>10} {'change':>8}")
+    for name, result in new["scenarios"].items():
+        base = old["scenarios"].get(name)
+        if not base or "error" in result or "error" in base: continue
+        for metric, higher_is_better in COMPARED.items():
+            a, b = base[metric], result[metric]
+            change = (b - a) / a * 100 if a else 0.0
+            worse = change < -5 if higher_is_better else change > 5
+            print(f"{name:<20} {metric:<26} {a:>10} {b:>10} {change:>+7.1f}%{'  !' if worse else ''}")
+
+def replay(path, url, concurrency, secret):
+    """POSTs recorded updates (WEBHOOK_RECORD_FILE lines) to a running webhook-mode bot"""
+    with open(path) as f:
+        updates = [line for line in f if line.strip()]
+    headers = {"Content-Type": "application/json"}
+    if secret: headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    def post(body):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, body.encode(), headers), timeout=30) as resp:
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 0
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, updates))
+    elapsed = time.perf_counter() - started
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = sorted(t for _, t in results)
+    print(json.dumps({
+        "updates": len(results), "statuses": statuses, "seconds": round(elapsed, 3),
+        "throughput": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1), "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS), help="run only these")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a parameter")
+    parser.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files")
+    parser.add_argument("--replay", nargs=2, metavar=("FILE", "URL"), help="post recorded updates to a webhook")
+    parser.add_argument("--concurrency", type=int, default=20, help="parallel POSTs for --replay")
+    parser.add_argument("--secret", help="webhook secret token for --replay")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--params", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.replay:
+        replay(*args.replay, args.concurrency, args.secret)
+        return
+    if args.run:
+        run_child(args.run, json.loads(args.params))
+        return
+
+    overrides = parse_overrides(args.set)
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        params = {**DEFAULTS, **SCENARIOS[name], **overrides}
+        print(f"⏱️ {name}...", file=sys.stderr)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", name, "--params", json.dumps(params)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            results[name] = {"params": params, "error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+            print(f"❌ {name}: {results[name]['error'][0]}", file=sys.stderr)
+            continue
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        r = results[name]
+        ok = "✅" if not r["errors"] and not r["checksum_mismatches"] and not r["spool_leftovers"] else "❌"
+        print(f"{ok} {name}: {r['throughput']}/s p50 {r['p50_ms']}ms p99 {r['p99_ms']}ms "
+              f"rss {r['peak_rss_mb']}MB drive/action {r['drive_calls_per_action']}"
+              + (f" checksum mismatches {r['checksum_mismatches']}" if r["checksum_mismatches"] else "")
+              + (f" spool leftovers {r['spool_leftovers']}" if r["spool_leftovers"] else ""), file=sys.stderr)
+
+    report = {"commit": git_commit(), "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "python": platform.python_version(), "platform": platform.platform(), "scenarios": results}
+    if args.output:
+        with open(args.output, "w") as f: json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
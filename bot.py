@@ -1,29 +1,44 @@
+import time
+BOOT_STARTED = time.perf_counter()   # the startup report measures from here
 import logging
-import io
+import random
+import tempfile
+import shutil
+import zipfile
+from pathlib import Path
 import math
 import os
 import re
 import json
-import time
+import sys
+import base64
+import hashlib
 import asyncio
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import bisect
+import heapq
+import itertools
+import unicodedata
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, Future
 
 # --- FIX: LOAD ENVIRONMENT VARIABLES ---
 from dotenv import load_dotenv
 load_dotenv()
 # ---------------------------------------
 
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-from googleapiclient.http import MediaIoBaseDownload
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
+# The Google client libraries are imported on first use (boot() warms them) so polling starts sooner
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, InputFile
+from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, BaseUpdateProcessor
 from telegram.request import HTTPXRequest
-from telegram.error import Forbidden
+from telegram.error import Forbidden, RetryAfter, BadRequest
 
 # --- IMPORT KEEP_ALIVE FOR RENDER ---
-from keep_alive import keep_alive
+from keep_alive import keep_alive, add_webhook
+from store import Store
+from disk_cache import DiskCache
+import metrics
 
 # --- CONFIGURATION ---
 # We now load the token from the Environment Variable "BOT_TOKEN"
@@ -31,6 +46,64 @@ TOKEN = os.environ.get("BOT_TOKEN")
 ROOT_FOLDER_ID = "13OMd9S3N7ONRXiYFbbWPkavuwg3ZKqeD"
 ITEMS_PER_PAGE = 10
 KEY_FILE_NAME = "service_key.json" 
+LISTING_TTL = int(os.environ.get("LISTING_TTL", 900))            # seconds a folder listing stays fresh
+LISTING_CACHE_SIZE = int(os.environ.get("LISTING_CACHE_SIZE", 500))  # max folders kept in memory
+CHANGES_POLL_INTERVAL = int(os.environ.get("CHANGES_POLL_INTERVAL", 30))
+SEARCH_INDEX_FILE = "search_index.json"
+CRAWL_BATCH_SIZE = 50                                             # folder listings per Drive batch request
+SPOOL_DIR = os.environ.get("SPOOL_DIR") or None                   # None = system temp dir
+SPOOL_MEMORY_LIMIT = int(os.environ.get("SPOOL_MEMORY_LIMIT", 8 * 1024 * 1024))  # bytes kept in RAM per transfer
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+LOCAL_BOT_API_URL = (os.environ.get("LOCAL_BOT_API_URL") or "").rstrip("/") or None  # e.g. http://localhost:8081
+LOCAL_BOT_API_DIR = (os.environ.get("LOCAL_BOT_API_DIR") or None) if LOCAL_BOT_API_URL else None  # dir the server can read
+MAX_UPLOAD_BYTES = (2000 if LOCAL_BOT_API_URL else 99) * 1024 * 1024
+UPLOAD_LIMIT_LABEL = "2GB" if LOCAL_BOT_API_URL else "100MB"
+UPLOAD_TIMEOUT = 1800 if LOCAL_BOT_API_URL else 300
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))     # transfers running at once
+RANGED_CONNECTIONS = int(os.environ.get("RANGED_CONNECTIONS", 4)) # parallel byte ranges per large download
+RANGED_MIN_SIZE = 16 * 1024 * 1024                                # smaller files aren't worth splitting
+RANGE_CHUNK_MIN = 2 * 1024 * 1024
+RANGE_CHUNK_MAX = 8 * 1024 * 1024                                 # caps RAM per transfer at connections x this
+RANGE_RETRIES = 4
+DOWNLOAD_PER_USER = int(os.environ.get("DOWNLOAD_PER_USER", 1))   # transfers one user may run at once
+DISK_CACHE_DIR = os.environ.get("DISK_CACHE_DIR", "drive_cache")  # downloaded and exported bytes, reused across requests
+DISK_CACHE_MB = int(os.environ.get("DISK_CACHE_MB", 2048))         # LRU size cap; 0 disables the disk cache
+ZIP_CONCURRENCY = int(os.environ.get("ZIP_CONCURRENCY", 3))       # files of one folder ZIP downloading at once
+ZIP_MAX_PARTS = int(os.environ.get("ZIP_MAX_PARTS", 5))           # bigger folders get a Drive link instead
+ZIP_PART_MARGIN = 1024 * 1024                                      # headroom under the upload limit for ZIP headers
+STORE_FILE = os.environ.get("STORE_FILE", "bot.db")
+STORE_FLUSH_INTERVAL = 2                                          # seconds between batched store commits
+PREWARM_CHAT_ID = os.environ.get("PREWARM_CHAT_ID")                # private cache chat; unset disables pre-warming
+PREWARM_HOURS = os.environ.get("PREWARM_HOURS", "1-6")            # off-peak UTC hours, start-end
+PREWARM_BUDGET_MB = int(os.environ.get("PREWARM_BUDGET_MB", 1024))  # upload budget per UTC day
+PREWARM_INTERVAL = 600
+PREWARM_RECENT_WEIGHT = 5                                          # a file changed just now counts like 5 requests
+BROADCAST_ON_START = os.environ.get("BROADCAST_ON_START", "1") == "1"
+BROADCAST_DELAY = int(os.environ.get("BROADCAST_DELAY", 30))      # seconds after startup before sending
+BROADCAST_RATE = 25                                                # messages per second, under Telegram's ~30/s
+BROADCAST_CONCURRENCY = 8
+PROGRESS_CHAT_INTERVAL = 3                                         # min seconds between progress edits in one chat
+PROGRESS_GLOBAL_RATE = 10                                          # max progress edits per second across all chats
+CACHE_VALIDATE_AFTER = int(os.environ.get("CACHE_VALIDATE_AFTER", 6 * 3600))  # seconds before a hit re-checks Drive
+DRIVE_HTTP_TIMEOUT = int(os.environ.get("DRIVE_HTTP_TIMEOUT", 120))
+DRIVE_WORKERS = int(os.environ.get("DRIVE_WORKERS", 16))          # bound on concurrent Drive calls
+DRIVE_CALL_TIMEOUT = int(os.environ.get("DRIVE_CALL_TIMEOUT", 30))  # seconds before a handler gives up on Drive
+DRIVE_QUOTA_PER_MIN = int(os.environ.get("DRIVE_QUOTA_PER_MIN", 12000))  # Drive queries/minute granted to the project
+DRIVE_BURST = 50                                                   # queries allowed back to back before pacing starts
+DRIVE_RETRIES = 5                                                  # attempts after a 403 rate limit, 429 or 5xx
+DRIVE_BACKOFF_MAX = 32                                             # seconds, cap of the jittered exponential backoff
+META_BATCH_WINDOW = 0.02                                           # seconds concurrent files().get calls wait to share a batch
+META_BATCH_SIZE = 100                                              # Drive's limit per batch request
+SEARCH_CACHE_SIZE = 500                                            # search result lists kept for paging
+SEARCH_CACHE_TTL = 3600                                            # seconds a search can still be paged
+MENU_CACHE_SIZE = 2000                                             # rendered menu pages (and menu messages) remembered
+WEBHOOK_MODE = os.environ.get("WEBHOOK_MODE", "0") == "1"         # take updates on keep_alive's server instead of polling
+WEBHOOK_URL = (os.environ.get("WEBHOOK_URL") or "").rstrip("/") or None  # public base URL; unset = don't register (local testing)
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or None          # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_RECORD_FILE = os.environ.get("WEBHOOK_RECORD_FILE") or None  # append every accepted update here (JSON lines)
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", 16))         # handlers running at once, one per chat at most
+UPDATE_INFLIGHT_LIMIT = int(os.environ.get("UPDATE_INFLIGHT_LIMIT", 256))  # accepted-but-unfinished updates before the webhook sheds load
 
 # Check if Token exists
 if not TOKEN:
@@ -55,12 +128,23 @@ STRINGS = {
         'starting': "⬇️ Starting Request...",
         'fetching': "⏳ **Fetching Info...**",
         'error_fetch': "❌ Error fetching info: {msg}",
-        'file_too_large': "⚠️ **File too large (>100MB).**\n\n🔗 [Click to Open in Drive]({link})",
+        'file_too_large': "⚠️ **File too large (>{limit}).**\n\n🔗 [Click to Open in Drive]({link})",
         'dl_drive': "📥 **Downloading from Drive...**\n`{name}`\n{bar} {percent}%",
         'error_init': "❌ Init Error: {msg}",
         'ul_telegram': "📤 **Uploading to Telegram...**\n`{name}`\n{bar} {percent}%",
         'caption': "📄 **{name}**\n💾 Size: {size}\n📅 Date: {date}\n🤖 _Perfection In Physics Bot_",
-        'ul_failed': "⚠️ **Upload Failed.**\n\n🔗 [Click to Open in Drive]({link})"
+        'ul_failed': "⚠️ **Upload Failed.**\n\n🔗 [Click to Open in Drive]({link})",
+        'queued': "⏳ **Queued...**\n`{name}`\nPosition in queue: {pos}",
+        'waiting_same': "⏳ **Already being fetched for another user...**\n`{name}`",
+        'drive_busy': "⏳ Google Drive is busy right now, please try again in a minute.",
+        'search_expired': "⌛ This search has expired, please search again.",
+        'download_folder': "📦 Download All",
+        'zip_packing': "📦 **Packing folder...**\n`{name}`\n{bar} {done}/{total} files",
+        'zip_caption': "📦 **{name}**\n🗂 Files: {count}{part}\n🤖 _Perfection In Physics Bot_",
+        'zip_part': "\n🧩 Part {part}",
+        'zip_empty': "❌ This folder has no files to download.",
+        'zip_too_large': "⚠️ **Folder too large to send (>{limit}).**\n\n🔗 [Click to Open in Drive]({link})",
+        'zip_skipped': "⚠️ {count} file(s) could not be added (too large or failed).\n\n🔗 [Click to Open in Drive]({link})"
     },
     'ar': {
         'welcome': "🌟 **مرحبًا بك في Perfection In Physics** 🌟",
@@ -79,12 +163,23 @@ STRINGS = {
         'starting': "⬇️ جاري بدء الطلب...",
         'fetching': "⏳ **جاري جلب المعلومات...**",
         'error_fetch': "❌ خطأ في جلب المعلومات: {msg}",
-        'file_too_large': "⚠️ **الملف كبير جدًا (>100MB).**\n\n🔗 [اضغط هنا للفتح في درايف]({link})",
+        'file_too_large': "⚠️ **الملف كبير جدًا (>{limit}).**\n\n🔗 [اضغط هنا للفتح في درايف]({link})",
         'dl_drive': "📥 **جاري التنزيل من درايف...**\n`{name}`\n{bar} {percent}%",
         'error_init': "❌ خطأ في البدء: {msg}",
         'ul_telegram': "📤 **جاري الرفع إلى تيليجرام...**\n`{name}`\n{bar} {percent}%",
         'caption': "📄 **{name}**\n💾 الحجم: {size}\n📅 التاريخ: {date}\n🤖 _Perfection In Physics Bot_",
-        'ul_failed': "⚠️ **فشل الرفع.**\n\n🔗 [اضغط هنا للفتح في درايف]({link})"
+        'ul_failed': "⚠️ **فشل الرفع.**\n\n🔗 [اضغط هنا للفتح في درايف]({link})",
+        'queued': "⏳ **في قائمة الانتظار...**\n`{name}`\nترتيبك في الانتظار: {pos}",
+        'waiting_same': "⏳ **جاري تجهيز هذا الملف لمستخدم آخر...**\n`{name}`",
+        'drive_busy': "⏳ جوجل درايف مشغول حاليًا، حاول مرة أخرى بعد دقيقة.",
+        'search_expired': "⌛ انتهت صلاحية هذا البحث، يرجى البحث مرة أخرى.",
+        'download_folder': "📦 تحميل الكل",
+        'zip_packing': "📦 **جاري تجهيز المجلد...**\n`{name}`\n{bar} {done}/{total} ملفات",
+        'zip_caption': "📦 **{name}**\n🗂 الملفات: {count}{part}\n🤖 _Perfection In Physics Bot_",
+        'zip_part': "\n🧩 الجزء {part}",
+        'zip_empty': "❌ لا توجد ملفات في هذا المجلد للتحميل.",
+        'zip_too_large': "⚠️ **المجلد كبير جدًا للإرسال (>{limit}).**\n\n🔗 [اضغط هنا للفتح في درايف]({link})",
+        'zip_skipped': "⚠️ تعذر إضافة {count} ملف (كبير جدًا أو فشل التنزيل).\n\n🔗 [اضغط هنا للفتح في درايف]({link})"
     }
 }
 
@@ -97,65 +192,614 @@ logging.basicConfig(
 # --- GOOGLE DRIVE SETUP ---
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 
-try:
-    # Check if running on Render (Environment Variable)
-    if os.environ.get("GOOGLE_CREDENTIALS"):
-        logging.info("🔄 Loading credentials from Environment Variable...")
-        key_dict = json.loads(os.environ.get("GOOGLE_CREDENTIALS"))
-        creds = service_account.Credentials.from_service_account_info(key_dict, scopes=SCOPES)
-    
-    # Check if running Locally (File)
-    elif os.path.exists(KEY_FILE_NAME):
-        logging.info("📂 Loading credentials from Local File...")
-        creds = service_account.Credentials.from_service_account_file(KEY_FILE_NAME, scopes=SCOPES)
-    
-    else:
-        raise FileNotFoundError("No credentials found! Set GOOGLE_CREDENTIALS env var or add service_key.json")
+creds = None   # set by boot()
+
+def load_credentials():
+    from google.oauth2 import service_account
+    try:
+        # Check if running on Render (Environment Variable)
+        if os.environ.get("GOOGLE_CREDENTIALS"):
+            logging.info("🔄 Loading credentials from Environment Variable...")
+            key_dict = json.loads(os.environ.get("GOOGLE_CREDENTIALS"))
+            creds = service_account.Credentials.from_service_account_info(key_dict, scopes=SCOPES)
+        
+        # Check if running Locally (File)
+        elif os.path.exists(KEY_FILE_NAME):
+            logging.info("📂 Loading credentials from Local File...")
+            creds = service_account.Credentials.from_service_account_file(KEY_FILE_NAME, scopes=SCOPES)
         
-    logging.info("✅ Credentials Loaded Successfully")
+        else:
+            raise FileNotFoundError("No credentials found! Set GOOGLE_CREDENTIALS env var or add service_key.json")
+
+        logging.info("✅ Credentials Loaded Successfully")
+        return creds
+
+    except Exception as e:
+        logging.error(f"❌ Key Error: {e}")
+        return None
+
+# --- DRIVE CLIENT POOL ---
+drive_discovery_doc = None
+
+def drive_discovery():
+    """The Drive v3 discovery document shipped with googleapiclient, parsed once per process"""
+    global drive_discovery_doc
+    if drive_discovery_doc is None:
+        from googleapiclient.discovery_cache import get_static_doc
+        drive_discovery_doc = json.loads(get_static_doc('drive', 'v3'))
+    return drive_discovery_doc
+
+class DriveClientPool:
+    """One long-lived Drive client per thread, sharing a single credentials object"""
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.local = threading.local()
+        self.refresh_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.refreshes = 0
+        self.build_seconds = 0.0
+
+    def refresh_credentials(self):
+        import httplib2
+        import google_auth_httplib2
+        # Refresh once for the whole pool instead of racing in every thread
+        if self.credentials.valid: return
+        with self.refresh_lock:
+            if self.credentials.valid: return
+            self.credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT)))
+            with self.stats_lock:
+                self.refreshes += 1
+
+    def get(self):
+        self.refresh_credentials()
+        service = getattr(self.local, 'service', None)
+        if service is not None:
+            with self.stats_lock:
+                self.reused += 1
+            return service
+
+        from googleapiclient.discovery import build_from_document
+        started = time.perf_counter()
+        # httplib2.Http is not thread-safe, so each thread keeps its own keep-alive connection
+        service = build_from_document(drive_discovery(), http=self.new_http())
+        self.local.service = service
+        with self.stats_lock:
+            self.created += 1
+            self.build_seconds += time.perf_counter() - started
+        return service
+
+    def new_http(self):
+        """Dedicated connection for long transfers that hop between worker threads"""
+        import httplib2
+        import google_auth_httplib2
+        self.refresh_credentials()
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "clients_created": self.created,
+                "clients_reused": self.reused,
+                "credential_refreshes": self.refreshes,
+                "avg_build_ms": round(self.build_seconds / self.created * 1000, 1) if self.created else 0.0,
+            }
+
+drive_pool = None   # set by boot() once credentials are loaded
+metrics.Gauge("drive_client_pool", "Drive client pool: clients built/reused, credential refreshes, build time", ("stat",),
+              fn=lambda: {(k,): v for k, v in drive_pool.stats().items()} if drive_pool is not None else {})
+
+# --- ASYNC DRIVE LAYER ---
+# Every Drive call from a handler goes through this bounded pool so the event loop never blocks on Drive
+drive_executor = ThreadPoolExecutor(max_workers=DRIVE_WORKERS, thread_name_prefix="drive")
+# File bytes get their own threads so bulk transfers never queue ahead of menu listings
+media_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS * RANGED_CONNECTIONS, thread_name_prefix="media")
+
+# Quota lanes: what a user is waiting on always gets the next Drive token before crawls and pre-warming
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+drive_lane = threading.local()
+
+def current_lane():
+    return getattr(drive_lane, 'name', INTERACTIVE)
+
+def in_lane(lane, func, *args):
+    previous = current_lane()
+    drive_lane.name = lane
+    try:
+        return func(*args)
+    finally:
+        drive_lane.name = previous
+
+async def run_drive(func, *args, timeout=DRIVE_CALL_TIMEOUT, pool=None, lane=INTERACTIVE):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(pool or drive_executor, in_lane, lane, func, *args), timeout)
+
+# --- METRICS ---
+# Rendered by keep_alive's /metrics; every hook below is a dict update under one lock
+DRIVE_CALLS = metrics.Counter("drive_calls_total", "Drive API calls", ("op", "outcome"))
+DRIVE_LATENCY = metrics.Histogram("drive_call_seconds", "Drive API call latency", ("op",))
+TRANSFER_BYTES = metrics.Counter("transfer_bytes_total", "Bytes moved", ("phase",))
+TRANSFER_SECONDS = metrics.Histogram("transfer_seconds", "Transfer duration", ("phase",), metrics.DURATION_BUCKETS)
+TRANSFER_RATE = metrics.Histogram("transfer_bytes_per_second", "Transfer throughput", ("phase",),
+                                  (256 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2,
+                                   20 * 1024 ** 2, 50 * 1024 ** 2, 100 * 1024 ** 2))
+TRANSFER_MEMORY = metrics.Histogram("transfer_peak_memory_bytes", "Estimated peak RAM held by one download",
+                                    (), metrics.BYTES_BUCKETS)
+CACHE_LOOKUPS = metrics.Counter("file_id_cache_lookups_total", "file_id cache lookups", ("result",))
+DOWNLOADS_ACTIVE = metrics.Gauge("downloads_in_flight", "handle_download calls in progress")
+LOOP_LAG = metrics.Histogram("event_loop_lag_seconds", "Delay of a scheduled wake-up on the event loop")
+LOOP_LAG_INTERVAL = 1
+DRIVE_RETRY_COUNT = metrics.Counter("drive_retries_total", "Drive calls retried after backoff", ("op", "reason"))
+DRIVE_QUOTA_WAIT = metrics.Histogram("drive_quota_wait_seconds", "Time spent waiting for a Drive quota token", ("lane",))
+META_BATCHED = metrics.Counter("drive_meta_batched_total", "files().get calls answered from a shared batch")
+WEBHOOK_UPDATES = metrics.Counter("webhook_updates_total", "Webhook POSTs by outcome", ("result",))
+MENU_RENDERS = metrics.Counter("menu_renders_total", "send_menu calls by render cache outcome", ("result",))
+
+def observe_transfer(phase, size, seconds):
+    TRANSFER_BYTES.inc(phase, amount=size)
+    TRANSFER_SECONDS.observe(seconds, phase)
+    if seconds > 0: TRANSFER_RATE.observe(size / seconds, phase)
+
+def process_rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+async def measure_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+# --- DRIVE QUOTA ---
+class DriveLimiter:
+    """Token bucket sized to the project's Drive quota, shared by every worker thread.
+    While an interactive call is waiting, background calls don't get tokens."""
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.limited_at = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self, lane, cost=1):
+        """Blocks the calling worker thread until cost tokens are available"""
+        cost = min(cost, self.burst)
+        started = time.monotonic()
+        with self.cond:
+            self.waiting[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    yielding = lane == BACKGROUND and self.waiting[INTERACTIVE]
+                    if not yielding and self.tokens >= cost:
+                        self.tokens -= cost
+                        break
+                    self.cond.wait(max(cost - self.tokens, 0.1) / self.rate)
+            finally:
+                self.waiting[lane] -= 1
+                self.cond.notify_all()
+        DRIVE_QUOTA_WAIT.observe(time.monotonic() - started, lane)
+
+    def penalize(self):
+        """Drive said we're over quota: hand out nothing more until the bucket refills"""
+        with self.cond:
+            self.tokens = min(self.tokens, 0.0)
+            self.limited_at = time.monotonic()
+
+    def limited_recently(self, seconds=60):
+        return time.monotonic() - self.limited_at < seconds
+
+drive_limiter = DriveLimiter(DRIVE_QUOTA_PER_MIN, DRIVE_BURST)
+
+def drive_error_kind(e):
+    """(retry, rate_limited) for an exception raised by a Drive call"""
+    status = getattr(getattr(e, 'resp', None), 'status', None)
+    if status is None:
+        return isinstance(e, (TimeoutError, ConnectionError)), False
+    status = int(status)
+    if status == 429: return True, True
+    if status == 403:
+        # 403 is also "no access"; only the rate-limit reasons are worth retrying
+        content = getattr(e, 'content', b'') or b''
+        limited = b'ratelimitexceeded' in (content if isinstance(content, bytes) else content.encode()).lower()
+        return limited, limited
+    return status >= 500, False
+
+def drive_call(op, func, *args, cost=1):
+    """Runs func(*args) as one Drive call of kind op: waits for a quota token in the caller's
+    lane, retries rate limits and 5xx with jittered exponential backoff, records metrics"""
+    lane = current_lane()
+    for attempt in range(DRIVE_RETRIES + 1):
+        drive_limiter.acquire(lane, cost)
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            DRIVE_CALLS.inc(op, "error")
+            DRIVE_LATENCY.observe(time.perf_counter() - started, op)
+            retry, limited = drive_error_kind(e)
+            if limited: drive_limiter.penalize()
+            if not retry or attempt == DRIVE_RETRIES: raise
+            delay = random.uniform(0, min(DRIVE_BACKOFF_MAX, 2 ** attempt))
+            DRIVE_RETRY_COUNT.inc(op, "rate_limit" if limited else "server")
+            logging.warning(f"⏳ Drive {op} failed ({e}), retry {attempt + 1}/{DRIVE_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        DRIVE_CALLS.inc(op, "ok")
+        DRIVE_LATENCY.observe(time.perf_counter() - started, op)
+        return result
+
+def drive_execute(op, request, cost=1):
+    return drive_call(op, request.execute, cost=cost)
+
+def drive_error_key():
+    """Which message to show when a Drive-backed reply failed"""
+    return 'drive_busy' if drive_limiter.limited_recently() else 'error_drive'
+
+class MetaBatcher:
+    """Collects files().get calls made within META_BATCH_WINDOW of each other (duplicates
+    included) and answers them with one Drive batch request. The first caller of a window
+    leads: it sleeps out the window and runs the batch; the others block on their future."""
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.pending = OrderedDict()   # (file_id, fields) -> (Future, set of lanes)
+        self.lock = threading.Lock()
+
+    def get(self, file_id, fields):
+        """Blocking; call from a Drive worker thread"""
+        key = (file_id, fields)
+        with self.lock:
+            slot = self.pending.get(key)
+            leader = slot is None and not self.pending
+            if slot is None:
+                slot = self.pending[key] = (Future(), set())
+            slot[1].add(current_lane())
+            full = len(self.pending) >= self.max_size
+        if leader:
+            time.sleep(self.window)
+            self.flush()
+        elif full:
+            self.flush()
+        return slot[0].result()
+
+    def flush(self):
+        while True:
+            with self.lock:
+                if not self.pending: return
+                keys = list(itertools.islice(self.pending, self.max_size))
+                jobs = [(key, self.pending.pop(key)) for key in keys]
+            lane = INTERACTIVE if any(INTERACTIVE in lanes for _, (_, lanes) in jobs) else BACKGROUND
+            try:
+                in_lane(lane, self._run, jobs)
+            except BaseException as e:
+                # e.g. a credential refresh in drive_pool.get(); the other callers are blocked on these
+                for _, (future, _) in jobs:
+                    if not future.done(): future.set_exception(e)
+                if not isinstance(e, Exception): raise
+
+    def _single(self, service, key, future):
+        try:
+            future.set_result(drive_execute('get', service.files().get(fileId=key[0], fields=key[1])))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _run(self, jobs):
+        service = drive_pool.get()
+        if len(jobs) == 1:
+            key, (future, _) = jobs[0]
+            self._single(service, key, future)
+            return
 
-except Exception as e:
-    logging.error(f"❌ Key Error: {e}")
-    creds = None
+        retry = []
+        def on_response(request_id, response, exception):
+            key, (future, _) = jobs[int(request_id)]
+            if exception is None: future.set_result(response)
+            elif drive_error_kind(exception)[0]: retry.append((key, future))
+            else: future.set_exception(exception)
+
+        batch = service.new_batch_http_request(callback=on_response)
+        for i, ((file_id, fields), _) in enumerate(jobs):
+            batch.add(service.files().get(fileId=file_id, fields=fields), request_id=str(i))
+        try:
+            drive_execute('batch', batch, cost=len(jobs))
+            META_BATCHED.inc(amount=len(jobs))
+        except Exception as e:
+            retry = []
+            for _, (future, _) in jobs:
+                if not future.done(): future.set_exception(e)
+        # Entries the batch answered with a rate limit or 5xx go through the single-call backoff
+        for key, future in retry:
+            self._single(service, key, future)
+        for _, (future, _) in jobs:
+            if not future.done(): future.set_exception(RuntimeError("missing batch response"))
+
+meta_batcher = MetaBatcher(META_BATCH_WINDOW, META_BATCH_SIZE)
 
 # --- MEMORY & CACHE & USERS ---
-folder_names = {ROOT_FOLDER_ID: "Root"}
-parent_map = {}
-search_cache = {}
 background_tasks = set()
 
-# Load File ID Cache
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+class TTLCache:
+    """Bounded map with TTL expiry and LRU eviction (thread-safe). Every put gets a new stamp,
+    which lets other caches refer to a stored value without keeping it alive."""
+    stamps = itertools.count(1)
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value, _ = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._pop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (time.monotonic(), value, next(TTLCache.stamps))
+            self._added(key, value)
+            while len(self.entries) > self.max_size:
+                self._pop(next(iter(self.entries)))
+
+    def invalidate(self, key):
+        with self.lock:
+            return self._pop(key) is not None
+
+    def stamp(self, key, value, unwrap=None):
+        """Stamp of the entry under key while it still holds this exact value, else None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None: return None
+            stored = unwrap(entry[1]) if unwrap else entry[1]
+            return entry[2] if stored is value else None
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._pop(key)
+
+    def _pop(self, key):
+        # Every removal (expiry, eviction, invalidation, replacement) goes through here, lock held
+        entry = self.entries.pop(key, None)
+        if entry is not None: self._removed(key, entry[1])
+        return entry
+
+    def _added(self, key, value): pass
+
+    def _removed(self, key, value): pass
+
+    def __len__(self):
+        return len(self.entries)
+
+class ListingCache(TTLCache):
+    """Folder listings in Drive's order, plus which cached folders list each item so a change
+    invalidates by lookup instead of scanning every listing"""
+    def __init__(self, max_size, ttl):
+        super().__init__(max_size, ttl)
+        # item id -> folder id, or a set of them for the few items listed in several cached folders
+        self.listed_in = {}
+
+    def _added(self, folder_id, files):
+        listed_in = self.listed_in
+        for f in files:
+            item_id = f['id']
+            held = listed_in.get(item_id)
+            if held is None: listed_in[item_id] = folder_id
+            elif isinstance(held, set): held.add(folder_id)
+            elif held != folder_id: listed_in[item_id] = {held, folder_id}
+
+    def _removed(self, folder_id, files):
+        listed_in = self.listed_in
+        for f in files:
+            item_id = f['id']
+            held = listed_in.get(item_id)
+            if isinstance(held, set):
+                held.discard(folder_id)
+                if len(held) == 1: listed_in[item_id] = next(iter(held))
+            elif held == folder_id:
+                del listed_in[item_id]
+
+    def invalidate_item(self, item_id):
+        """Drop every cached folder that currently lists item_id (covers moves/deletes)"""
+        with self.lock:
+            held = self.listed_in.get(item_id)
+            stale = list(held) if isinstance(held, set) else [held] if held else []
+            for fid in stale:
+                self._pop(fid)
+            return stale
+
+listing_cache = ListingCache(LISTING_CACHE_SIZE, LISTING_TTL)
+
+class FileRecord:
+    """Compact, read-only Drive item for the long-lived caches (listings, search index, results).
+    Reads like the files().list dict it replaces: f['name'], f.get('size'), f.get('parents')."""
+    __slots__ = ('id', 'name', 'mimeType', 'size', 'parents')
+
+    def __init__(self, f):
+        self.id = f['id']
+        self.name = f['name']
+        self.mimeType = sys.intern(f['mimeType'])
+        size = f.get('size')
+        self.size = int(size) if size is not None else None
+        parents = f.get('parents')
+        self.parents = tuple(parents) if parents else None
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in FileRecord.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None: raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __eq__(self, other):
+        return isinstance(other, FileRecord) and all(getattr(self, k) == getattr(other, k) for k in FileRecord.__slots__)
+
+    __hash__ = None
+
+    def as_dict(self):
+        d = {k: getattr(self, k) for k in FileRecord.__slots__ if getattr(self, k) is not None}
+        if 'parents' in d: d['parents'] = list(d['parents'])
+        return d
+
+class SearchResult:
+    __slots__ = ('query', 'files')
+
+    def __init__(self, query, files):
+        self.query = query
+        self.files = files
+
+def search_token(query):
+    """Short stable key for a query's results; raw queries can overflow the 64-byte callback data"""
+    digest = hashlib.blake2s(query.encode('utf-8'), digest_size=8).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+search_results = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)   # token -> SearchResult
+
+# File ID cache + user list live in SQLite; the dicts below are the in-memory view
 CACHE_FILE = "file_ids.json"
-try:
-    with open(CACHE_FILE, "r") as f:
-        file_id_cache = json.load(f)
-except (FileNotFoundError, json.JSONDecodeError):
-    file_id_cache = {}
-
-def save_cache():
-    try:
-        with open(CACHE_FILE, "w") as f:
-            json.dump(file_id_cache, f)
-    except: pass
-
-# Load User List
 USERS_FILE = "users.json"
-try:
-    with open(USERS_FILE, "r") as f:
-        subscribed_users = set(json.load(f))
-except (FileNotFoundError, json.JSONDecodeError):
-    subscribed_users = set()
+store = None               # opened by boot()
+disk_cache = None          # opened by boot() unless DISK_CACHE_MB is 0
+file_id_cache = {}
+subscribed_users = set()
+
+def cache_file_id(file_id, tg_file_id, meta):
+    entry = {
+        'tg_file_id': tg_file_id,
+        'name': file_display_name(meta),
+        'size': int(meta.get('size', 0)),
+        'mime_type': meta.get('mimeType'),
+        'modified_time': meta.get('modifiedTime'),
+        'md5': meta.get('md5Checksum'),
+        'link': meta.get('webViewLink'),
+        'checked_at': time.time(),
+    }
+    file_id_cache[file_id] = entry
+    store.put_file_id(file_id, entry)
 
-def save_users():
-    try:
-        with open(USERS_FILE, "w") as f:
-            json.dump(list(subscribed_users), f)
-    except: pass
+def forget_file_id(file_id):
+    if file_id_cache.pop(file_id, None) is not None:
+        store.delete_file_id(file_id)
+
+def entry_is_stale(entry, meta):
+    # Google Docs have no md5, their modifiedTime is the only version signal
+    if entry.get('md5') and meta.get('md5Checksum'):
+        return entry['md5'] != meta['md5Checksum']
+    return entry.get('modified_time') != meta.get('modifiedTime')
 
 def register_user(user_id):
     if user_id not in subscribed_users:
         subscribed_users.add(user_id)
-        save_users()
+        store.add_user(user_id)
+
+async def flush_store():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(STORE_FLUSH_INTERVAL)
+        try:
+            await loop.run_in_executor(None, store.flush)
+        except Exception as e:
+            logging.error(f"Store Flush Error: {e}")
+
+# --- FOLDER TREE ---
+class FolderTree:
+    """id -> name/parent/children for every known folder, persisted in the store (thread-safe)"""
+    def __init__(self):
+        self.names = {ROOT_FOLDER_ID: "Root"}
+        self.parents = {}
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        with self.lock:
+            for folder_id, name, parent_id in rows:
+                self._link(folder_id, name, parent_id)
+
+    def _link(self, folder_id, name, parent_id):
+        old_parent = self.parents.get(folder_id)
+        if old_parent and old_parent != parent_id:
+            self.children.get(old_parent, set()).discard(folder_id)
+        if folder_id != ROOT_FOLDER_ID: self.names[folder_id] = name
+        if parent_id:
+            self.parents[folder_id] = parent_id
+            self.children.setdefault(parent_id, set()).add(folder_id)
+
+    def put(self, folder_id, name, parent_id):
+        with self.lock:
+            parent_id = parent_id or self.parents.get(folder_id)
+            if self.names.get(folder_id) == name and self.parents.get(folder_id) == parent_id: return
+            self._link(folder_id, name, parent_id)
+        store.put_folder(folder_id, name, parent_id)
+
+    def remove(self, folder_id):
+        with self.lock:
+            self.names.pop(folder_id, None)
+            parent_id = self.parents.pop(folder_id, None)
+            if parent_id: self.children.get(parent_id, set()).discard(folder_id)
+        store.delete_folder(folder_id)
+
+    def name(self, folder_id, default=None):
+        return self.names.get(folder_id, default)
+
+    def parent(self, folder_id):
+        return self.parents.get(folder_id)
+
+    def path(self, folder_id, limit=10):
+        """Breadcrumb names root-first, or None if an ancestor isn't known yet"""
+        names = []
+        current_id = folder_id
+        with self.lock:
+            while len(names) < limit:
+                if current_id not in self.names: return None
+                names.insert(0, self.names[current_id])
+                if current_id == ROOT_FOLDER_ID: break
+                current_id = self.parents.get(current_id)
+                if current_id is None: return None
+        return names
+
+    def apply_changes(self, changes):
+        for ch in changes:
+            meta = ch.get('file')
+            file_id = ch.get('fileId')
+            if ch.get('removed') or not meta or meta.get('trashed'):
+                if file_id in self.names: self.remove(file_id)
+            elif meta.get('mimeType') == 'application/vnd.google-apps.folder':
+                parents = meta.get('parents') or []
+                self.put(file_id, meta['name'], parents[0] if parents else None)
+
+folder_tree = FolderTree()
 
 def get_text(key, lang_code, **kwargs):
     """Helper to get translated string"""
@@ -165,30 +809,128 @@ def get_text(key, lang_code, **kwargs):
 
 # --- PROGRESS HELPER ---
 class ProgressReader:
+    """File wrapper that reports upload percent; the callback must be thread-safe (see ProgressReporter)"""
     def __init__(self, file_obj, size, update_callback):
         self.file = file_obj
         self.size = size
         self.callback = update_callback
         self.bytes_read = 0
-        self.last_update = time.time()
+        self.last_percent = -1
 
     def read(self, size=-1):
         data = self.file.read(size)
         if data:
             self.bytes_read += len(data)
-            now = time.time()
-            if now - self.last_update > 4:
-                self.last_update = now
-                percent = int((self.bytes_read / self.size) * 100)
-                asyncio.run_coroutine_threadsafe(
-                    self.callback(percent),
-                    asyncio.get_running_loop()
-                )
+            percent = int((self.bytes_read / self.size) * 100) if self.size else 0
+            if percent != self.last_percent:
+                self.last_percent = percent
+                self.callback(percent)
         return data
 
     def seek(self, *args): return self.file.seek(*args)
     def tell(self): return self.file.tell()
 
+class ProgressReporter:
+    """Single outlet for progress edits. Events are coalesced per message (only the newest text
+    is kept), unchanged text is never re-sent, and edits are spaced per chat and globally so
+    progress never eats the API budget of real replies."""
+    def __init__(self, chat_interval, global_rate):
+        self.chat_interval = chat_interval
+        self.global_interval = 1 / global_rate
+        self.pending = OrderedDict()     # (chat_id, message_id) -> (message, text)
+        self.last_text = OrderedDict()   # (chat_id, message_id) -> text currently on the message
+        self.chat_ready_at = {}          # chat_id -> monotonic time the chat may be edited again
+        self.inflight = {}               # (chat_id, message_id) -> Event set once the edit being sent returns
+        self.finished = OrderedDict()    # (chat_id, message_id) handed back by done(); late reports are dropped
+        self.loop = None
+        self.wakeup = None
+        self.edits = 0
+        self.skipped = 0
+        self.throttled = 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        spawn(self._run())
+
+    def report(self, message, text):
+        """Thread-safe; callable from the event loop or any worker thread"""
+        if self.loop is None: return
+        self.loop.call_soon_threadsafe(self._enqueue, message, text)
+
+    async def done(self, message):
+        """Forget a message before it gets its final text or is deleted. Returns once no progress
+        edit of it can still land, so the caller's own edit is the last word."""
+        key = (message.chat_id, message.message_id)
+        self.pending.pop(key, None)
+        self.last_text.pop(key, None)
+        self.finished[key] = True
+        while len(self.finished) > 5000: self.finished.popitem(last=False)
+        edit = self.inflight.get(key)
+        if edit is not None: await edit.wait()
+
+    def _enqueue(self, message, text):
+        key = (message.chat_id, message.message_id)
+        # A worker thread's report can arrive after done()
+        if key in self.finished: return
+        if self.last_text.get(key) == text:
+            self.pending.pop(key, None)
+            self.skipped += 1
+            return
+        self.pending[key] = (message, text)
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            key = next((k for k in self.pending if self.chat_ready_at.get(k[0], 0) <= now), None)
+            if key is None:
+                # Every pending chat is still inside its budget window
+                self.wakeup.clear()
+                wait = min(self.chat_ready_at[k[0]] for k in self.pending) - now
+                try: await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError: pass
+                continue
+
+            message, text = self.pending.pop(key)
+            self.chat_ready_at[key[0]] = now + self.chat_interval
+            edit = self.inflight[key] = asyncio.Event()
+            delay = 0
+            try:
+                await message.edit_text(text, parse_mode='Markdown')
+                self.edits += 1
+                if key not in self.finished: self.last_text[key] = text
+                while len(self.last_text) > 5000: self.last_text.popitem(last=False)
+            except RetryAfter as e:
+                # Flood control applies to the whole bot: requeue unless newer text arrived, then back off
+                self.throttled += 1
+                if key not in self.finished: self.pending.setdefault(key, (message, text))
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            except BadRequest as e:
+                if "not modified" in str(e) and key not in self.finished: self.last_text[key] = text
+            except Exception as e:
+                logging.warning(f"Progress Edit Error: {e}")
+            finally:
+                del self.inflight[key]
+                edit.set()
+            if delay: await asyncio.sleep(delay)
+            # Drop stale chat budgets so the dict doesn't grow with every chat ever seen
+            if len(self.chat_ready_at) > 1000:
+                self.chat_ready_at = {c: t for c, t in self.chat_ready_at.items() if t > now}
+            await asyncio.sleep(self.global_interval)
+
+    def stats(self):
+        return {"pending": len(self.pending), "edits": self.edits, "skipped": self.skipped, "throttled": self.throttled}
+
+progress_reporter = ProgressReporter(PROGRESS_CHAT_INTERVAL, PROGRESS_GLOBAL_RATE)
+metrics.Gauge("progress_edits", "Progress reporter: queued edits and edits sent/skipped/throttled since start", ("stat",),
+              fn=lambda: {(k,): v for k, v in progress_reporter.stats().items()})
+
 def make_bar(percent):
     filled = int(percent / 10)
     empty = 10 - filled
@@ -226,24 +968,23 @@ def get_icon(mime, name):
     if 'zip' in mime or 'rar' in name_l: return "📦"
     return "📄"
 
-def build_path_string(service_instance, folder_id):
+def build_path_string(folder_id):
+    """Slow path for folders the tree doesn't fully know yet; fills the gaps from Drive"""
     if folder_id == ROOT_FOLDER_ID: return "Root"
     current_id = folder_id
     path_names = []
     loop_limit = 0
     while current_id and loop_limit < 10:
-        if current_id in folder_names:
-            name = folder_names[current_id]
-        else:
+        name = folder_tree.name(current_id)
+        if name is None or (current_id != ROOT_FOLDER_ID and folder_tree.parent(current_id) is None):
             try:
-                meta = service_instance.files().get(fileId=current_id, fields='name, parents').execute()
+                meta = meta_batcher.get(current_id, 'name, parents')
                 name = meta.get('name', 'Unknown')
-                folder_names[current_id] = name
-                if 'parents' in meta: parent_map[current_id] = meta['parents'][0]
-            except: name = "Unknown"
+                folder_tree.put(current_id, name, (meta.get('parents') or [None])[0])
+            except: name = name or "Unknown"
         path_names.insert(0, name)
         if current_id == ROOT_FOLDER_ID: break
-        current_id = parent_map.get(current_id)
+        current_id = folder_tree.parent(current_id)
         loop_limit += 1
     return " » ".join(path_names)
 
@@ -251,65 +992,493 @@ def natural_keys(text):
     return [int(c) if c.isdigit() else c.lower() for c in re.split(r'(\d+)', text)]
 
 # --- DRIVE ACTIONS ---
-def get_files(folder_id):
-    if not creds: return None
-    try:
-        service = build('drive', 'v3', credentials=creds, cache_discovery=False)
-        results = service.files().list(
+def iter_file_pages(folder_id):
+    """Yields (files, has_more) per Drive page until nextPageToken runs out"""
+    page_token = None
+    while True:
+        # Fetch the client per page: the generator may be resumed on a different worker thread
+        results = drive_execute('list', drive_pool.get().files().list(
             q=f"'{folder_id}' in parents and trashed = false",
             pageSize=1000,
+            pageToken=page_token,
+            orderBy="folder,name_natural",
             fields="nextPageToken, files(id, name, mimeType, size, parents)"
-        ).execute()
-
-        all_files = results.get('files', [])
-        folders = []
-        files = []
-        for f in all_files:
-            if f['mimeType'] == 'application/vnd.google-apps.folder':
-                folders.append(f)
-            else:
-                files.append(f)
-
-        folders.sort(key=lambda x: natural_keys(x['name']))
-        files.sort(key=lambda x: natural_keys(x['name']))
-
-        return folders + files
+        ))
+        page_token = results.get('nextPageToken')
+        yield [FileRecord(f) for f in results.get('files', [])], bool(page_token)
+        if not page_token: return
+
+# --- STREAMED LISTINGS ---
+listing_fetches = {}
+
+async def stream_listing(folder_id, first_page):
+    """Pulls every Drive page into listing_cache, resolving first_page as soon as one page is in"""
+    pages = iter_file_pages(folder_id)
+    items = []
+    try:
+        while True:
+            files, has_more = await run_drive(next, pages)
+            items.extend(files)
+            if not has_more: break
+            if not first_page.done(): first_page.set_result((list(items), False))
+
+        # Kept in Drive's folder,name_natural order: the first page was already shown in it,
+        # so re-sorting here would make Next repeat or skip items
+        listing = items
+        listing_cache.put(folder_id, listing)
     except Exception as e:
         logging.error(f"API Error: {e}")
-        return None
+        listing = None
+    if not first_page.done(): first_page.set_result((listing, True))
+    return listing
+
+async def list_folder(folder_id, wait=True):
+    """Returns (files, complete). With wait=False a large folder answers with its first Drive page
+    while the remaining pages keep streaming into listing_cache in the background."""
+    if not creds: return None, True
+    cached = listing_cache.get(folder_id)
+    if cached is not None: return cached, True
+
+    fetch = listing_fetches.get(folder_id)
+    if fetch is None:
+        first_page = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(stream_listing(folder_id, first_page))
+        fetch = listing_fetches[folder_id] = (task, first_page)
+        task.add_done_callback(lambda t: listing_fetches.pop(folder_id, None))
+
+    task, first_page = fetch
+    if wait: return await task, True
+    return await first_page
 
 def search_drive(query):
     if not creds: return []
     try:
-        service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        service = drive_pool.get()
         query = query.replace("'", "\\'")
-        results = service.files().list(
+        results = drive_execute('list', service.files().list(
             q=f"name contains '{query}' and trashed = false",
             pageSize=50, fields="nextPageToken, files(id, name, mimeType, size, parents)",
-            orderBy="name").execute()
-        return results.get('files', [])
+            orderBy="name"))
+        return [FileRecord(f) for f in results.get('files', [])]
     except Exception as e: return []
 
+# --- SEARCH INDEX ---
+ARABIC_MARKS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')  # tashkeel + tatweel
+ARABIC_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه'})
+ARABIC_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ARABIC_MARKS.sub('', text).translate(ARABIC_LETTERS).translate(ARABIC_DIGITS)
+
+def tokenize(text):
+    # Split letters from digits so "Ch1" matches "ch 1"
+    return re.findall(r'\d+|[^\W\d_]+', normalize_text(text))
+
+def token_variants(token):
+    # Index Arabic words with and without the definite article
+    if token.startswith('ال') and len(token) > 3: return (token, token[2:])
+    return (token,)
+
+def within_distance(a, b, max_dist):
+    if abs(len(a) - len(b)) > max_dist: return False
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > max_dist: return False
+        prev = cur
+    return prev[-1] <= max_dist
+
+class SearchIndex:
+    """Inverted index over every file/folder name under ROOT_FOLDER_ID (thread-safe)"""
+    def __init__(self, path):
+        self.path = path
+        self.items = {}
+        self.postings = {}
+        self.rank_keys = {}   # id -> (normalized name, natural sort key), so search() doesn't redo them
+        self.vocab = []
+        self.vocab_stale = False
+        self.page_token = None
+        self.ready = False
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _index(self, item):
+        self.rank_keys[item['id']] = (normalize_text(item['name']), natural_keys(item['name']))
+        for tok in tokenize(item['name']):
+            for v in token_variants(tok):
+                self.postings.setdefault(v, set()).add(item['id'])
+
+    def _unindex(self, item):
+        self.rank_keys.pop(item['id'], None)
+        for tok in tokenize(item['name']):
+            for v in token_variants(tok):
+                ids = self.postings.get(v)
+                if ids is None: continue
+                ids.discard(item['id'])
+                if not ids: del self.postings[v]
+
+    def add(self, f):
+        item = f if isinstance(f, FileRecord) else FileRecord(f)
+        with self.lock:
+            old = self.items.get(item['id'])
+            if old == item: return
+            if old: self._unindex(old)
+            self.items[item['id']] = item
+            self._index(item)
+            self.vocab_stale = True
+            self.dirty = True
+
+    def remove(self, item_id):
+        with self.lock:
+            old = self.items.pop(item_id, None)
+            if not old: return
+            self._unindex(old)
+            self.vocab_stale = True
+            self.dirty = True
+
+    def in_tree(self, parents):
+        return any(p == ROOT_FOLDER_ID or p in self.items for p in parents or [])
+
+    def apply_changes(self, changes):
+        for ch in changes:
+            file_id = ch.get('fileId')
+            if not file_id: continue
+            meta = ch.get('file')
+            if ch.get('removed') or not meta or meta.get('trashed') or not self.in_tree(meta.get('parents')):
+                self.remove(file_id)
+            else:
+                self.add(dict(meta, id=file_id))
+
+    def _matches(self, qtok):
+        """id -> score for one query token: exact 3, prefix 2, fuzzy 1"""
+        scores = {}
+        for v in token_variants(qtok):
+            for i in self.postings.get(v, ()):
+                scores[i] = 3
+        start = bisect.bisect_left(self.vocab, qtok)
+        for tok in itertools.islice(self.vocab, start, None):
+            if not tok.startswith(qtok): break
+            for i in self.postings[tok]:
+                scores.setdefault(i, 2)
+        if not scores and len(qtok) >= 4:
+            max_dist = 2 if len(qtok) >= 8 else 1
+            for tok in self.vocab:
+                if within_distance(qtok, tok, max_dist):
+                    for i in self.postings[tok]:
+                        scores.setdefault(i, 1)
+        return scores
+
+    def search(self, query, limit=100):
+        """CPU-bound on big trees; call it off the event loop"""
+        qtoks = tokenize(query)
+        if not qtoks: return []
+        phrase = normalize_text(query).strip()
+        with self.lock:
+            if self.vocab_stale:
+                self.vocab = sorted(self.postings)
+                self.vocab_stale = False
+            totals = None
+            for qtok in qtoks:
+                scores = self._matches(qtok)
+                if totals is None:
+                    totals = scores
+                else:
+                    # Every query token has to match something in the name
+                    totals = {i: s + scores[i] for i, s in totals.items() if i in scores}
+                if not totals: return []
+            ranked = []
+            for i, score in totals.items():
+                name, sort_key = self.rank_keys[i]
+                if name.startswith(phrase): score += 3
+                elif phrase in name: score += 2
+                ranked.append((-score, sort_key, self.items[i]))
+        return [r[2] for r in heapq.nsmallest(limit, ranked, key=lambda r: (r[0], r[1]))]
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        # Without a feed position we can't catch up on changes made while offline
+        if not data.get('page_token'): return False
+        for item in data.get('items', []):
+            self.add(item)
+        self.page_token = data['page_token']
+        self.ready = True
+        self.dirty = False
+        return True
+
+    def save(self):
+        with self.lock:
+            data = {"page_token": self.page_token, "items": [item.as_dict() for item in self.items.values()]}
+            self.dirty = False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+search_index = SearchIndex(SEARCH_INDEX_FILE)
+
+def list_children_batch(requests):
+    """Lists several (folder_id, page_token) pages in one Drive batch HTTP call.
+    Returns [(folder_id, files, next_page_token, error)]."""
+    service = drive_pool.get()
+    results = []
+    retry = []
+
+    def list_page(folder_id, page_token):
+        return service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            pageSize=1000,
+            pageToken=page_token,
+            fields="nextPageToken, files(id, name, mimeType, size, parents)"
+        )
+
+    def on_response(request_id, response, exception):
+        folder_id, page_token = requests[int(request_id)]
+        if exception is None:
+            results.append((folder_id, response.get('files', []), response.get('nextPageToken'), None))
+        elif drive_error_kind(exception)[0]: retry.append((folder_id, page_token))
+        else: results.append((folder_id, [], page_token, exception))
+
+    batch = service.new_batch_http_request(callback=on_response)
+    for i, (folder_id, page_token) in enumerate(requests):
+        batch.add(list_page(folder_id, page_token), request_id=str(i))
+    drive_execute('batch', batch, cost=len(requests))
+    # Pages the batch answered with a rate limit or 5xx go through the single-call backoff
+    for folder_id, page_token in retry:
+        try:
+            response = drive_execute('list', list_page(folder_id, page_token))
+            results.append((folder_id, response.get('files', []), response.get('nextPageToken'), None))
+        except Exception as e:
+            results.append((folder_id, [], page_token, e))
+    return results
+
+async def crawl_drive_tree():
+    """One-time batched BFS under ROOT_FOLDER_ID that warms both the search index and the
+    folder tree; afterwards the changes feed keeps them current"""
+    started = time.time()
+    pending = [(ROOT_FOLDER_ID, None)]
+    retries = {}
+    failed = []
+    while pending:
+        chunk, pending = pending[:CRAWL_BATCH_SIZE], pending[CRAWL_BATCH_SIZE:]
+        try:
+            results = await run_drive(list_children_batch, chunk, timeout=DRIVE_HTTP_TIMEOUT, lane=BACKGROUND)
+        except Exception as e:
+            logging.error(f"Crawl Batch Error: {e}")
+            results = [(folder_id, [], page_token, e) for folder_id, page_token in chunk]
+
+        for folder_id, files, next_token, error in results:
+            if error is not None:
+                retries[folder_id] = retries.get(folder_id, 0) + 1
+                if retries[folder_id] <= 3: pending.append((folder_id, next_token))
+                else:
+                    logging.error(f"Crawl Error ({folder_id}): {error}")
+                    failed.append(folder_id)
+                continue
+            if next_token: pending.append((folder_id, next_token))
+            for f in files:
+                search_index.add(f)
+                if f['mimeType'] == 'application/vnd.google-apps.folder':
+                    folder_tree.put(f['id'], f['name'], folder_id)
+                    pending.append((f['id'], None))
+
+    search_index.ready = True
+    if failed:
+        # Left unset so the next boot crawls again instead of trusting an index with holes
+        logging.error(f"🔎 Drive tree crawl incomplete: {len(failed)} folders failed, {len(search_index.items)} items")
+        return
+    store.set_meta('tree_warm', '1')
+    logging.info(f"🔎 Drive tree crawled: {len(search_index.items)} items in {time.time() - started:.1f}s")
+
+# --- CHANGE FEED ---
+def get_start_page_token():
+    if not creds: return None
+    try:
+        service = drive_pool.get()
+        return drive_execute('changes', service.changes().getStartPageToken()).get('startPageToken')
+    except Exception as e:
+        logging.error(f"Changes Token Error: {e}")
+        return None
+
+def poll_changes_worker(page_token):
+    """Reads the Drive changes feed from page_token, returns (changes, new_start_token)"""
+    service = drive_pool.get()
+    changes = []
+    while page_token:
+        res = drive_execute('changes', service.changes().list(
+            pageToken=page_token,
+            pageSize=1000,
+            includeRemoved=True,
+            fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(name, mimeType, size, parents, trashed, modifiedTime, md5Checksum))"
+        ))
+        changes.extend(res.get('changes', []))
+        if 'newStartPageToken' in res:
+            return changes, res['newStartPageToken']
+        page_token = res.get('nextPageToken')
+    return changes, page_token
+
+def apply_changes(changes):
+    """Invalidates only the folder listings touched by the given changes"""
+    touched = set()
+    for ch in changes:
+        file_id = ch.get('fileId')
+        if not file_id: continue
+        meta = ch.get('file') or {}
+        # New parents (add/rename) plus whichever cached folder listed it before (move/delete)
+        for pid in meta.get('parents', []):
+            if listing_cache.invalidate(pid): touched.add(pid)
+        touched.update(listing_cache.invalidate_item(file_id))
+    return touched
+
+recent_changes = OrderedDict()   # drive file id -> time it was last added/changed in the tree
+
+def note_changed_files(changes):
+    now = time.time()
+    for ch in changes:
+        meta = ch.get('file')
+        if ch.get('removed') or not meta or meta.get('trashed'): continue
+        if meta.get('mimeType') == 'application/vnd.google-apps.folder': continue
+        if not search_index.in_tree(meta.get('parents')): continue
+        recent_changes[ch['fileId']] = now
+        recent_changes.move_to_end(ch['fileId'])
+    while len(recent_changes) > 2000:
+        recent_changes.popitem(last=False)
+
+async def watch_changes():
+    # Resume from the persisted index position so changes made while offline are replayed
+    page_token = search_index.page_token
+    if not search_index.ready or not store.get_meta('tree_warm'):
+        spawn(crawl_drive_tree())
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if page_token is None:
+                page_token = await run_drive(get_start_page_token, lane=BACKGROUND)
+            else:
+                changes, page_token = await run_drive(poll_changes_worker, page_token, timeout=DRIVE_HTTP_TIMEOUT, lane=BACKGROUND)
+                if changes:
+                    touched = apply_changes(changes)
+                    search_index.apply_changes(changes)
+                    folder_tree.apply_changes(changes)
+                    note_changed_files(changes)
+                    check_cached_changes(changes)
+                    logging.info(f"🔄 Drive changes: {len(changes)} items, {len(touched)} folders invalidated")
+            search_index.page_token = page_token
+            if search_index.ready and search_index.dirty:
+                await loop.run_in_executor(None, search_index.save)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Keep the token and retry it next round; listings still expire by TTL
+            logging.error(f"Changes Poll Error: {e}")
+        await asyncio.sleep(CHANGES_POLL_INTERVAL)
+
 # --- MENU GENERATOR ---
-async def send_menu(update: Update, files, context_id, page=0, is_search=False, msg=None):
+class MenuCache:
+    """Ready-to-send (title, markup) per menu page, plus what each menu message currently shows.
+    A page is versioned by the stamp of the listing_cache / search_results entry it was rendered
+    from: any refresh, invalidation or eviction there retires it, and no listing is kept alive
+    here once its cache let go of it. Event-loop only (LRU)."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()   # (context_id, page, lang, is_search, complete) -> (stamp, extra, title, markup)
+        self.shown = OrderedDict()     # (chat_id, message_id) -> (title, markup)
+
+    def get(self, key, stamp, extra):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != stamp or entry[1] != extra: return None
+        self.entries.move_to_end(key)
+        return entry[2], entry[3]
+
+    def put(self, key, stamp, extra, title, markup):
+        self.entries[key] = (stamp, extra, title, markup)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def is_shown(self, message, title, markup):
+        return self.shown.get((message.chat_id, message.message_id)) == (title, markup)
+
+    def mark_shown(self, message, title, markup):
+        key = (message.chat_id, message.message_id)
+        self.shown[key] = (title, markup)
+        self.shown.move_to_end(key)
+        while len(self.shown) > self.max_size:
+            self.shown.popitem(last=False)
+
+menu_cache = MenuCache(MENU_CACHE_SIZE)
+metrics.Gauge("cache_entries", "Entries held by each in-memory cache", ("cache",),
+              fn=lambda: {("listings",): len(listing_cache), ("search_results",): len(search_results),
+                          ("menu_pages",): len(menu_cache.entries), ("menu_messages",): len(menu_cache.shown),
+                          ("folders",): len(folder_tree.names), ("search_index",): len(search_index.items),
+                          ("disk",): len(disk_cache) if disk_cache is not None else 0})
+metrics.Gauge("disk_cache_bytes", "Bytes held by the on-disk Drive cache", fn=lambda: disk_cache.total if disk_cache is not None else 0)
+metrics.Gauge("cache_lookups", "Hits and misses of the in-memory TTL caches since start", ("cache", "result"),
+              fn=lambda: {(name, result): getattr(cache, result) for name, cache in
+                          (("listings", listing_cache), ("search_results", search_results)) for result in ("hits", "misses")})
+
+def menu_context(context_id, is_search):
+    """Folder-tree state a rendered folder page depends on besides its listing: (breadcrumbs, parent)"""
+    if is_search: return None
+    return tuple(folder_tree.path(context_id) or ()), folder_tree.parent(context_id)
+
+async def send_menu(update: Update, files, context_id, page=0, is_search=False, msg=None, complete=True, query=None):
     # Detect Language
     lang = update.effective_user.language_code.split('-')[0] if update.effective_user.language_code else 'en'
 
+    key = (context_id, page, lang, is_search, complete)
+    # None for a listing that isn't (or is no longer) the cached one, e.g. a first streamed page
+    if is_search: stamp = search_results.stamp(context_id, files, unwrap=lambda result: result.files)
+    else: stamp = listing_cache.stamp(context_id, files)
+    rendered = menu_cache.get(key, stamp, menu_context(context_id, is_search)) if stamp else None
+    MENU_RENDERS.inc("hit" if rendered else "miss")
+    if rendered is None:
+        rendered = await render_menu(files, context_id, page, is_search, complete, lang, query)
+        extra = menu_context(context_id, is_search)
+        # A page whose breadcrumbs fell back to "Folder" is re-rendered next time
+        if stamp and (is_search or extra[0]): menu_cache.put(key, stamp, extra, *rendered)
+    title, reply_markup = rendered
+
+    if msg and menu_cache.is_shown(msg, title, reply_markup):
+        MENU_RENDERS.inc("unchanged")
+        return
+    try:
+        if msg: sent = await msg.edit_text(title, reply_markup=reply_markup, parse_mode='Markdown')
+        else: sent = await update.message.reply_text(title, reply_markup=reply_markup, parse_mode='Markdown')
+        if not isinstance(sent, bool): menu_cache.mark_shown(sent, title, reply_markup)
+    except Exception: pass
+
+async def render_menu(files, context_id, page, is_search, complete, lang, query=None):
+    """Builds the (title, markup) of one menu page; for search results context_id is the search token"""
     keyboard = []
     total_pages = math.ceil(len(files) / ITEMS_PER_PAGE)
+    # A still-streaming listing only knows a lower bound for its page count
+    total_label = total_pages if complete else f"{total_pages}+"
 
     if is_search:
-        title = get_text('search_header', lang, context=context_id, count=len(files))
+        title = get_text('search_header', lang, context=query, count=len(files))
     else:
-        service = build('drive', 'v3', credentials=creds, cache_discovery=False)
-        path = build_path_string(service, context_id)
+        names = folder_tree.path(context_id)
+        if names is not None:
+            path = " » ".join(names)
+        else:
+            try:
+                path = await run_drive(build_path_string, context_id)
+            except asyncio.TimeoutError:
+                path = folder_tree.name(context_id, "Folder")
 
         if context_id == ROOT_FOLDER_ID:
             current_name = get_text('home', lang).replace("🏠 ", "")
         else:
-            current_name = folder_names.get(context_id, "Folder")
+            current_name = folder_tree.name(context_id, "Folder")
 
-        title = get_text('browser_header', lang, name=current_name, path=path, page=page+1, total=total_pages)
+        title = get_text('browser_header', lang, name=current_name, path=path, page=page+1, total=total_label)
 
     start = page * ITEMS_PER_PAGE
     end = start + ITEMS_PER_PAGE
@@ -320,10 +1489,9 @@ async def send_menu(update: Update, files, context_id, page=0, is_search=False,
 
     for f in current_files:
         icon = get_icon(f['mimeType'], f['name'])
-        folder_names[f['id']] = f['name']
-
         if f['mimeType'] == 'application/vnd.google-apps.folder':
-            parent_map[f['id']] = context_id
+            parent_id = (f.get('parents') or [None])[0] if is_search else context_id
+            folder_tree.put(f['id'], f['name'], parent_id)
             keyboard.append([InlineKeyboardButton(f"{icon} {f['name']}", callback_data=f"OPEN|{f['id']}")])
         else:
             size = format_size(f.get('size'))
@@ -334,41 +1502,68 @@ async def send_menu(update: Update, files, context_id, page=0, is_search=False,
 
     nav = []
     if not is_search:
-        pid = parent_map.get(context_id)
+        pid = folder_tree.parent(context_id)
         if context_id != ROOT_FOLDER_ID:
             if pid:
                 nav.append(InlineKeyboardButton(get_text('back', lang), callback_data=f"OPEN|{pid}"))
             nav.append(InlineKeyboardButton(get_text('home', lang), callback_data=f"OPEN|{ROOT_FOLDER_ID}"))
+        if any(f['mimeType'] != 'application/vnd.google-apps.folder' for f in files):
+            nav.append(InlineKeyboardButton(get_text('download_folder', lang), callback_data=f"ZIP|{context_id}"))
 
-    if total_pages > 1:
+    if total_pages > 1 or not complete:
         prefix = "SPAGE" if is_search else "PAGE"
         if page > 0: nav.append(InlineKeyboardButton(get_text('prev', lang), callback_data=f"{prefix}|{context_id}|{page-1}"))
-        nav.append(InlineKeyboardButton(get_text('page_fmt', lang, page=page+1, total=total_pages), callback_data="IGNORE"))
-        if page < total_pages - 1: nav.append(InlineKeyboardButton(get_text('next', lang), callback_data=f"{prefix}|{context_id}|{page+1}"))
+        nav.append(InlineKeyboardButton(get_text('page_fmt', lang, page=page+1, total=total_label), callback_data="IGNORE"))
+        if page < total_pages - 1 or not complete: nav.append(InlineKeyboardButton(get_text('next', lang), callback_data=f"{prefix}|{context_id}|{page+1}"))
     if nav: keyboard.append(nav)
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    try:
-        if msg: await msg.edit_text(title, reply_markup=reply_markup, parse_mode='Markdown')
-        else: await update.message.reply_text(title, reply_markup=reply_markup, parse_mode='Markdown')
-    except Exception: pass
+    return title, InlineKeyboardMarkup(keyboard)
 
 # --- WORKER FUNCTIONS ---
 def get_meta_worker(file_id):
     if not creds: return {"status": "error", "msg": "No Credentials"}
     try:
-        thread_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
-        meta = thread_service.files().get(
-            fileId=file_id,
-            fields='name, size, mimeType, webViewLink, modifiedTime'
-        ).execute()
-        return {"status": "ok", "meta": meta}
+        meta = meta_batcher.get(file_id, 'name, size, mimeType, webViewLink, modifiedTime, md5Checksum')
+        return {"status": "ok", "meta": dict(meta)}
     except Exception as e:
         return {"status": "error", "msg": str(e)}
 
-def init_download_worker(file_id, meta):
+# --- SPOOL FILES ---
+def safe_filename(name):
+    return re.sub(r'[\\/\x00]', '_', name)[:200] or "file"
+
+def open_spool(name):
+    """Download target for one transfer. With a local Bot API server the file is written into the
+    shared directory under its real name so the server can pick it up by path."""
+    if LOCAL_BOT_API_DIR:
+        folder = tempfile.mkdtemp(dir=LOCAL_BOT_API_DIR)
+        os.chmod(folder, 0o755)
+        path = os.path.join(folder, safe_filename(name))
+        fh = open(path, 'w+b')
+        os.chmod(path, 0o644)
+        return fh
+    # RAM holds at most SPOOL_MEMORY_LIMIT of the file; the rest rolls over to disk
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT, dir=SPOOL_DIR)
+
+def close_spool(fh):
+    fh.close()
+    if LOCAL_BOT_API_DIR:
+        shutil.rmtree(os.path.dirname(fh.name), ignore_errors=True)
+
+def upload_source(fh, size, name, on_progress=None):
+    """What to pass as `document` for a finished spool"""
+    if LOCAL_BOT_API_DIR:
+        # local_mode sends a file:// URI; the server reads the file itself, no bytes pass through Python
+        fh.flush()
+        return Path(fh.name)
+    if on_progress: fh = ProgressReader(fh, size, on_progress)
+    # read_file_handle=False lets httpx stream the spool instead of reading it into memory
+    return InputFile(fh, filename=name, read_file_handle=False)
+
+def init_download_worker(file_id, meta, fh):
+    from googleapiclient.http import MediaIoBaseDownload
     try:
-        thread_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        thread_service = drive_pool.get()
         mime = meta.get('mimeType', '')
 
         request = None
@@ -376,142 +1571,1065 @@ def init_download_worker(file_id, meta):
             request = thread_service.files().export_media(fileId=file_id, mimeType='application/pdf')
         else:
             request = thread_service.files().get_media(fileId=file_id)
+        # next_chunk runs on whichever drive worker is free, so don't share this thread's client
+        request.http = drive_pool.new_http()
 
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request, chunksize=5 * 1024 * 1024)
-        return {"status": "ok", "downloader": downloader, "fh": fh}
+        downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+        return {"status": "ok", "downloader": downloader}
     except Exception as e:
         return {"status": "error", "msg": str(e)}
 
+# --- DOWNLOAD SCHEDULER ---
+class DownloadJob:
+    __slots__ = ('user_id', 'file_id', 'run', 'future', 'on_position', 'position')
+
+    def __init__(self, user_id, file_id, run, future, on_position):
+        self.user_id = user_id
+        self.file_id = file_id
+        self.run = run
+        self.future = future
+        self.on_position = on_position
+        self.position = None
+
+class DownloadScheduler:
+    """Bounded transfer pool with a round-robin queue across users and same-file coalescing"""
+    def __init__(self, workers, per_user):
+        self.workers = workers
+        self.per_user = per_user
+        self.queues = OrderedDict()   # user_id -> deque of waiting jobs
+        self.active = {}              # user_id -> running transfers
+        self.inflight = {}            # drive file_id -> future of the Telegram file_id
+        self.running = 0
+        self.coalesced = 0
+
+    def submit(self, user_id, file_id, run, on_position):
+        """Returns (future, is_leader). Only the leader's run() transfers; everyone else shares its result."""
+        future = self.inflight.get(file_id)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[file_id] = future
+        self.queues.setdefault(user_id, deque()).append(DownloadJob(user_id, file_id, run, future, on_position))
+        self._dispatch()
+        return future, True
+
+    def queued(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def stats(self):
+        return {"running": self.running, "queued": self.queued(), "coalesced": self.coalesced}
+
+    def _next_job(self):
+        for user_id in list(self.queues):
+            if self.active.get(user_id, 0) >= self.per_user: continue
+            jobs = self.queues.pop(user_id)
+            job = jobs.popleft()
+            # Re-append at the end so the next free slot goes to another user first
+            if jobs: self.queues[user_id] = jobs
+            return job
+        return None
+
+    def _dispatch(self):
+        while self.running < self.workers:
+            job = self._next_job()
+            if job is None: break
+            self.running += 1
+            self.active[job.user_id] = self.active.get(job.user_id, 0) + 1
+            spawn(self._run(job))
+        self._report_positions()
+
+    def _report_positions(self):
+        # Position = order in which the round-robin will reach each waiting job
+        order = []
+        lanes = [list(q) for q in self.queues.values()]
+        for rank in range(max((len(l) for l in lanes), default=0)):
+            order.extend(l[rank] for l in lanes if rank < len(l))
+        for pos, job in enumerate(order, 1):
+            if job.position == pos: continue
+            job.position = pos
+            job.on_position(pos)
+
+    async def _run(self, job):
+        result = None
+        try:
+            result = await job.run()
+        except Exception as e:
+            logging.error(f"Transfer Error ({job.file_id}): {e}")
+        finally:
+            self.running -= 1
+            self.active[job.user_id] -= 1
+            if not self.active[job.user_id]: del self.active[job.user_id]
+            self.inflight.pop(job.file_id, None)
+            if not job.future.done(): job.future.set_result(result)
+            self._dispatch()
+
+download_scheduler = DownloadScheduler(DOWNLOAD_WORKERS, DOWNLOAD_PER_USER)
+# Read from the metrics thread; a scrape racing a dict resize just skips one sample
+metrics.Gauge("download_jobs", "Scheduled transfers by state", ("state",),
+              fn=lambda: {("running",): download_scheduler.running, ("queued",): download_scheduler.queued()})
+metrics.Gauge("download_coalesced", "Requests that joined a transfer already running for the same file",
+              fn=lambda: download_scheduler.stats()["coalesced"])
+metrics.Gauge("process_resident_memory_bytes", "Resident set size", fn=process_rss)
+metrics.Gauge("file_id_cache_entries", "Cached Telegram file_ids", fn=lambda: len(file_id_cache))
+
+def file_display_name(meta):
+    name = meta.get('name', 'File')
+    if "application/vnd.google-apps" in meta.get('mimeType', '') and "folder" not in meta.get('mimeType', ''):
+        name += ".pdf"
+    return name
+
+# --- RANGED DOWNLOADS ---
+def fetch_range_worker(file_id, start, end):
+    """One byte range of a binary Drive file over this thread's pooled connection"""
+    request = drive_pool.get().files().get_media(fileId=file_id)
+    request.headers['Range'] = f"bytes={start}-{end}"
+    started = time.perf_counter()
+    data = drive_execute('get_media', request)
+    return data, time.perf_counter() - started
+
+def write_at(fh, lock, offset, data):
+    with lock:
+        fh.seek(offset)
+        fh.write(data)
+
+async def download_ranged(file_id, fh, size, on_progress=None, lane=INTERACTIVE):
+    """Fetches RANGED_CONNECTIONS byte ranges at a time and writes each at its offset in fh.
+    Every connection sizes its next range from how long the last one took; a failed range
+    is retried on its own without restarting the file."""
+    loop = asyncio.get_running_loop()
+    lock = threading.Lock()
+    next_offset = 0
+    received = 0
+
+    async def connection():
+        nonlocal next_offset, received
+        chunk = RANGE_CHUNK_MIN
+        while next_offset < size:
+            start = next_offset
+            end = min(size, start + chunk) - 1
+            next_offset = end + 1
+            for attempt in range(RANGE_RETRIES):
+                try:
+                    data, elapsed = await run_drive(fetch_range_worker, file_id, start, end,
+                                                    timeout=DRIVE_HTTP_TIMEOUT, pool=media_executor, lane=lane)
+                    if len(data) != end - start + 1:
+                        raise IOError(f"short range {start}-{end}: got {len(data)} bytes")
+                    break
+                except Exception as e:
+                    if attempt == RANGE_RETRIES - 1: raise
+                    logging.warning(f"Range {start}-{end} of {file_id} failed ({e}), retrying")
+                    await asyncio.sleep(2 ** attempt)
+            await loop.run_in_executor(None, write_at, fh, lock, start, data)
+            received += len(data)
+            if on_progress: on_progress(int(received / size * 100))
+            # Aim for a few seconds per request: long enough to amortize latency, short enough to retry cheaply
+            if elapsed < 1: chunk = min(chunk * 2, RANGE_CHUNK_MAX)
+            elif elapsed > 5: chunk = max(chunk // 2, RANGE_CHUNK_MIN)
+
+    tasks = [asyncio.create_task(connection()) for _ in range(RANGED_CONNECTIONS)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks: t.cancel()
+        raise
+
+def spool_memory(size):
+    """RAM a finished spool of this size occupies"""
+    return 0 if LOCAL_BOT_API_DIR else min(size, SPOOL_MEMORY_LIMIT)
+
+def disk_cache_key(file_id, meta):
+    """What download_to_spool produces for meta, by content: binaries by md5 (copies of one file
+    in several folders share an entry), Docs exports by file and revision. None = not cacheable."""
+    mime = meta.get('mimeType', '')
+    if "application/vnd.google-apps" in mime:
+        return f"pdf:{file_id}:{meta['modifiedTime']}" if meta.get('modifiedTime') else None
+    return f"md5:{meta['md5Checksum']}" if meta.get('md5Checksum') else None
+
+def open_disk_cached(key, name):
+    """A spool serving a disk_cache entry in place, or None on a miss. A local Bot API server
+    needs the file in its directory under the real name, so there it gets a hard link."""
+    fh = disk_cache.open(key)
+    if fh is None or not LOCAL_BOT_API_DIR: return fh
+    folder = tempfile.mkdtemp(dir=LOCAL_BOT_API_DIR)
+    os.chmod(folder, 0o755)
+    path = os.path.join(folder, safe_filename(name))
+    try:
+        os.link(fh.name, path)
+    except OSError:
+        shutil.copyfile(fh.name, path)
+    fh.close()
+    os.chmod(path, 0o644)
+    return open(path, 'rb')
+
+async def download_to_spool(file_id, meta, on_progress=None, lane=INTERACTIVE):
+    """Pulls a Drive file into a spool file; returns (fh, size). The caller closes fh.
+    Bytes already in disk_cache are served from there without calling Drive."""
+    loop = asyncio.get_running_loop()
+    mime = meta.get('mimeType', '')
+    size = int(meta.get('size', 0))
+    started = time.perf_counter()
+    key = disk_cache_key(file_id, meta) if disk_cache is not None else None
+    if key:
+        fh = await loop.run_in_executor(None, open_disk_cached, key, file_display_name(meta))
+        CACHE_LOOKUPS.inc("disk_hit" if fh else "disk_miss")
+        if fh is not None:
+            fh.seek(0, os.SEEK_END)
+            size = fh.tell()
+            fh.seek(0)
+            if on_progress: on_progress(100)
+            return fh, size
+
+    # Without a local Bot API server the download is written straight into the cache directory
+    direct = key is not None and not LOCAL_BOT_API_DIR
+    fh = disk_cache.create() if direct else open_spool(file_display_name(meta))
+    try:
+        # Google Docs exports are generated on the fly and can't be ranged
+        if "application/vnd.google-apps" not in mime and RANGED_CONNECTIONS > 1 and size >= RANGED_MIN_SIZE:
+            await download_ranged(file_id, fh, size, on_progress, lane)
+            buffers = RANGED_CONNECTIONS * RANGE_CHUNK_MAX
+        else:
+            init_res = await run_drive(init_download_worker, file_id, meta, fh, lane=lane)
+            if init_res['status'] != 'ok':
+                raise RuntimeError(init_res['msg'])
+
+            downloader = init_res['downloader']
+            op = "export" if "application/vnd.google-apps" in mime else "get_media"
+            done = False
+            while not done:
+                status_obj, done = await run_drive(drive_call, op, downloader.next_chunk,
+                                                   timeout=DRIVE_HTTP_TIMEOUT, pool=media_executor, lane=lane)
+                if on_progress and status_obj:
+                    on_progress(int(status_obj.progress() * 100))
+            buffers = DOWNLOAD_CHUNK_SIZE
+
+        # A failed flush (e.g. a full disk) must fail the transfer, not upload a truncated file
+        fh.flush()
+        # Size from the spool itself; getvalue() would copy the whole file into RAM again
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        if 'size' in meta and size != int(meta['size']):
+            raise RuntimeError(f"short download: {size} of {meta['size']} bytes")
+        observe_transfer("download", size, time.perf_counter() - started)
+        TRANSFER_MEMORY.observe((0 if direct else spool_memory(size)) + buffers)
+        try:
+            if direct:
+                await loop.run_in_executor(None, disk_cache.commit, fh, key)
+            elif key:
+                await loop.run_in_executor(None, disk_cache.add_file, fh.name, key)
+        except OSError as e:
+            # A full disk only costs the cache entry, never the transfer
+            logging.warning(f"Disk cache write failed ({file_id}): {e}")
+        fh.seek(0)
+        return fh, size
+    except BaseException:
+        if direct: disk_cache.discard(fh)
+        else: close_spool(fh)
+        raise
+
+async def transfer_file(query, status, file_id, meta, name, caption, lang, link):
+    """Downloads from Drive and uploads to the requesting chat; returns the Telegram file_id or None"""
+    # 3. DOWNLOAD
+    def download_progress_callback(percent):
+        progress_reporter.report(status, get_text('dl_drive', lang, name=name, bar=make_bar(percent), percent=percent))
+
+    download_progress_callback(0)
+    try:
+        fh, spooled_size = await download_to_spool(file_id, meta, download_progress_callback)
+    except Exception as e:
+        await progress_reporter.done(status)
+        await status.edit_text(get_text('error_init', lang, msg=str(e) or "Drive timeout"))
+        return None
+
+    try:
+        # 4. UPLOAD
+        def upload_progress_callback(percent):
+            progress_reporter.report(status, get_text('ul_telegram', lang, name=name, bar=make_bar(percent), percent=percent))
+
+        upload_progress_callback(0)
+
+        try:
+            started = time.perf_counter()
+            sent_msg = await query.message.reply_document(
+                document=upload_source(fh, spooled_size, name, upload_progress_callback),
+                caption=caption,
+                parse_mode='Markdown',
+                read_timeout=UPLOAD_TIMEOUT,
+                write_timeout=UPLOAD_TIMEOUT,
+                connect_timeout=300
+            )
+            observe_transfer("upload", spooled_size, time.perf_counter() - started)
+
+            tg_file_id = None
+            if sent_msg.document:
+                tg_file_id = sent_msg.document.file_id
+                cache_file_id(file_id, tg_file_id, meta)
+
+            await progress_reporter.done(status)
+            await status.delete()
+            return tg_file_id
+        except Exception as e:
+            await progress_reporter.done(status)
+            try:
+                await status.edit_text(get_text('ul_failed', lang, link=link), parse_mode='Markdown')
+            except: pass
+            return None
+    finally:
+        close_spool(fh)
+
 async def handle_download(update, file_id):
+    DOWNLOADS_ACTIVE.add(1)
     try:
         query = update.callback_query
         register_user(query.from_user.id)
+        store.record_hit(file_id, time.time())
         # Detect Language
         lang = query.from_user.language_code.split('-')[0] if query.from_user.language_code else 'en'
 
         await query.answer(get_text('starting', lang), show_alert=False)
 
-        # 1. FETCH METADATA
+        # 1. CACHE HIT: caption data is stored with the Telegram file_id, so no Drive call
+        entry = file_id_cache.get(file_id)
+        CACHE_LOOKUPS.inc("hit" if entry else "miss")
+        if entry and entry.get('name'):
+            caption = get_text('caption', lang, name=entry['name'], size=format_size(entry.get('size')),
+                               date=format_date(entry.get('modified_time')))
+            try:
+                await query.message.reply_document(
+                    document=entry['tg_file_id'],
+                    caption=caption,
+                    parse_mode='Markdown'
+                )
+                spawn(validate_cached(file_id))
+                return
+            except Exception as e:
+                logging.warning(f"Cached ID failed: {e}")
+                forget_file_id(file_id)
+
+        # 2. FETCH METADATA
         status = await query.message.reply_text(get_text('fetching', lang))
-        loop = asyncio.get_running_loop()
 
-        with ThreadPoolExecutor() as pool:
-            meta_res = await loop.run_in_executor(pool, get_meta_worker, file_id)
+        try:
+            meta_res = await run_drive(get_meta_worker, file_id)
+        except asyncio.TimeoutError:
+            meta_res = {"status": "error", "msg": "Drive timeout"}
 
         if meta_res['status'] != 'ok':
             await status.edit_text(get_text('error_fetch', lang, msg=meta_res['msg']))
             return
 
         meta = meta_res['meta']
-        name = meta.get('name', 'File')
+        name = file_display_name(meta)
         size_bytes = int(meta.get('size', 0))
         size_str = format_size(size_bytes)
         mod_time = format_date(meta.get('modifiedTime'))
         link = meta.get('webViewLink', '')
 
-        if "application/vnd.google-apps" in meta.get('mimeType', '') and "folder" not in meta.get('mimeType', ''):
-            name += ".pdf"
-
         caption = get_text('caption', lang, name=name, size=size_str, date=mod_time)
 
-        # 2. CACHE CHECK
+        # Entries migrated from file_ids.json have no metadata yet; fill it in on first use
         if file_id in file_id_cache:
-            tg_file_id = file_id_cache[file_id]
+            tg_file_id = file_id_cache[file_id]['tg_file_id']
             try:
                 await query.message.reply_document(
                     document=tg_file_id,
                     caption=caption,
                     parse_mode='Markdown'
                 )
+                cache_file_id(file_id, tg_file_id, meta)
                 await status.delete()
                 return
             except Exception as e:
                 logging.warning(f"Cached ID failed: {e}")
+                forget_file_id(file_id)
 
         # Size Check
-        if size_bytes > 99 * 1024 * 1024:
-            await status.edit_text(get_text('file_too_large', lang, link=link), parse_mode='Markdown')
+        if size_bytes > MAX_UPLOAD_BYTES:
+            await status.edit_text(get_text('file_too_large', lang, link=link, limit=UPLOAD_LIMIT_LABEL), parse_mode='Markdown')
             return
 
-        # 3. DOWNLOAD
-        await status.edit_text(get_text('dl_drive', lang, name=name, bar=make_bar(0), percent=0), parse_mode='Markdown')
-
-        with ThreadPoolExecutor() as pool:
-            init_res = await loop.run_in_executor(pool, init_download_worker, file_id, meta)
+        # 3+4. QUEUE THE TRANSFER (or join one already running for this file)
+        def on_position(pos):
+            progress_reporter.report(status, get_text('queued', lang, name=name, pos=pos))
 
-            if init_res['status'] != 'ok':
-                await status.edit_text(get_text('error_init', lang, msg=init_res['msg']))
-                return
-
-            downloader = init_res['downloader']
-            fh = init_res['fh']
-            done = False
-            last_update_time = time.time()
-
-            while not done:
-                status_obj, done = await loop.run_in_executor(pool, downloader.next_chunk)
-
-                now = time.time()
-                if now - last_update_time > 4:
-                    last_update_time = now
-                    if status_obj:
-                        progress = int(status_obj.progress() * 100)
-                        try:
-                            await status.edit_text(get_text('dl_drive', lang, name=name, bar=make_bar(progress), percent=progress), parse_mode='Markdown')
-                        except: pass
-
-            fh.seek(0)
-
-        # 4. UPLOAD
-        await status.edit_text(get_text('ul_telegram', lang, name=name, bar=make_bar(0), percent=0), parse_mode='Markdown')
+        future, is_leader = download_scheduler.submit(
+            query.from_user.id, file_id,
+            lambda: transfer_file(query, status, file_id, meta, name, caption, lang, link),
+            on_position
+        )
+        if is_leader:
+            await future
+            return
 
-        async def upload_progress_callback(percent):
+        progress_reporter.report(status, get_text('waiting_same', lang, name=name))
+        tg_file_id = await future
+        await progress_reporter.done(status)
+        try:
+            if not tg_file_id: raise RuntimeError("shared transfer failed")
+            await query.message.reply_document(document=tg_file_id, caption=caption, parse_mode='Markdown')
+            await status.delete()
+        except Exception:
             try:
-                await status.edit_text(get_text('ul_telegram', lang, name=name, bar=make_bar(percent), percent=percent), parse_mode='Markdown')
+                await status.edit_text(get_text('ul_failed', lang, link=link), parse_mode='Markdown')
             except: pass
 
-        progress_file = ProgressReader(fh, len(fh.getvalue()), upload_progress_callback)
+    except asyncio.CancelledError:
+        return
+    finally:
+        DOWNLOADS_ACTIVE.add(-1)
+
+# --- FOLDER ZIPS ---
+# Already-compressed formats go in as-is: deflating them burns CPU for next to no gain
+STORED_EXTENSIONS = ('.pdf', '.zip', '.rar', '.7z', '.gz', '.mp4', '.mkv', '.mov', '.avi', '.webm', '.mp3', '.m4a',
+                     '.ogg', '.jpg', '.jpeg', '.png', '.webp', '.docx', '.pptx', '.xlsx')
+
+def zip_compression(name, mime):
+    if mime.startswith(('video/', 'audio/', 'image/')) or name.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def list_folder_files(folder_id):
+    """Direct non-folder children with the fields the folder's content version is built from"""
+    files, page_token = [], None
+    while True:
+        results = drive_execute('list', drive_pool.get().files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            pageSize=1000,
+            pageToken=page_token,
+            orderBy="name_natural",
+            fields="nextPageToken, files(id, name, mimeType, size, md5Checksum, modifiedTime)"
+        ))
+        files.extend(f for f in results.get('files', []) if f['mimeType'] != 'application/vnd.google-apps.folder')
+        page_token = results.get('nextPageToken')
+        if not page_token: return files
+
+def folder_version(files):
+    """Changes whenever a file is added, removed, renamed or edited"""
+    digest = hashlib.blake2s(digest_size=12)
+    for f in sorted(files, key=lambda f: f['id']):
+        digest.update(f"{f['id']}|{f['name']}|{f.get('md5Checksum') or f.get('modifiedTime')}\n".encode())
+    return digest.hexdigest()
+
+class ZipParts:
+    """Packs finished spools into one ZIP part at a time, each written to its own spool file.
+    Every method blocks, so the caller runs them in an executor, one at a time."""
+    def __init__(self, name, max_bytes, numbered=False):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.numbered = numbered   # label part 1 too when more parts are expected
+        self.number = 0
+        self.fh = None
+        self.zf = None
+        self.count = 0
+        self.names = set()
+
+    def part_name(self):
+        if self.number <= 1 and not self.numbered: return f"{self.name}.zip"
+        return f"{self.name} ({self.number}).zip"
+
+    def fits(self, size):
+        # A deflated entry is never much larger than its input; each entry also adds ~100 bytes of headers
+        return self.zf is None or self.fh.tell() + size + 200 * (self.count + 1) <= self.max_bytes
+
+    def add(self, src, name, mime, modified=None):
+        if self.zf is None:
+            self.number += 1
+            self.fh = open_spool(self.part_name())
+            self.zf = zipfile.ZipFile(self.fh, 'w')
+            self.count = 0
+            self.names = set()
+        name = safe_filename(name)
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while name in self.names:
+            n += 1
+            name = f"{stem} ({n}){ext}"
+        self.names.add(name)
+        try:
+            date_time = datetime.fromisoformat(modified.replace('Z', '+00:00')).timetuple()[:6]
+        except (AttributeError, ValueError):
+            date_time = time.localtime()[:6]
+        info = zipfile.ZipInfo(name, date_time=max(date_time, (1980, 1, 1, 0, 0, 0)))
+        info.compress_type = zip_compression(name, mime)
+        src.seek(0)
+        with self.zf.open(info, 'w') as dest:
+            shutil.copyfileobj(src, dest, 1024 * 1024)
+        self.count += 1
+
+    def finish(self):
+        """Closes the current part; returns (fh, size, name, count). The caller closes fh."""
+        self.zf.close()
+        fh, self.zf, self.fh = self.fh, None, None
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        fh.seek(0)
+        return fh, size, self.part_name(), self.count
+
+    def discard(self):
+        if self.fh is not None:
+            close_spool(self.fh)
+            self.zf = self.fh = None
+
+async def zip_folder(query, status, folder_id, name, files, lang):
+    """Downloads ZIP_CONCURRENCY files at a time and packs each into the current ZIP part as it
+    arrives; a full part is uploaded before the next one starts, so at most one part plus
+    ZIP_CONCURRENCY files are ever spooled. Returns ([(tg_file_id, file count) per part], files left out)."""
+    loop = asyncio.get_running_loop()
+    limit = MAX_UPLOAD_BYTES - ZIP_PART_MARGIN
+    planned = math.ceil(sum(int(f.get('size', 0)) for f in files) / limit) or 1
+    parts = ZipParts(name, limit, numbered=planned > 1)
+    slots = asyncio.Semaphore(ZIP_CONCURRENCY)
+    tg_ids = []
+    failed = 0
+
+    async def fetch(meta):
+        # The slot is held until the file is packed, bounding how many finished spools wait
+        await slots.acquire()
+        try:
+            fh, size = await download_to_spool(meta['id'], meta)
+            return meta, fh, size
+        except Exception as e:
+            logging.warning(f"ZIP of {folder_id}: {meta['name']} failed ({e})")
+            slots.release()
+            return meta, None, 0
 
+    async def upload_part():
+        fh, size, part_name, count = await loop.run_in_executor(None, parts.finish)
         try:
+            def upload_progress_callback(percent):
+                progress_reporter.report(status, get_text('ul_telegram', lang, name=part_name, bar=make_bar(percent), percent=percent))
+
+            upload_progress_callback(0)
+            part = get_text('zip_part', lang, part=parts.number) if parts.numbered or parts.number > 1 else ""
+            started = time.perf_counter()
             sent_msg = await query.message.reply_document(
-                document=progress_file,
-                filename=name,
-                caption=caption,
+                document=upload_source(fh, size, part_name, upload_progress_callback),
+                caption=get_text('zip_caption', lang, name=name, count=count, part=part),
                 parse_mode='Markdown',
-                read_timeout=300,
-                write_timeout=300,
+                read_timeout=UPLOAD_TIMEOUT,
+                write_timeout=UPLOAD_TIMEOUT,
                 connect_timeout=300
             )
+            observe_transfer("upload", size, time.perf_counter() - started)
+            tg_ids.append((sent_msg.document.file_id, count))
+        finally:
+            close_spool(fh)
 
-            if sent_msg.document:
-                file_id_cache[file_id] = sent_msg.document.file_id
-                save_cache()
+    tasks = [asyncio.create_task(fetch(meta)) for meta in files]
+    try:
+        for done, next_file in enumerate(asyncio.as_completed(tasks), 1):
+            meta, fh, size = await next_file
+            if fh is None:
+                failed += 1
+                continue
+            try:
+                if not parts.fits(size): await upload_part()
+                await loop.run_in_executor(None, parts.add, fh, file_display_name(meta), meta['mimeType'],
+                                           meta.get('modifiedTime'))
+            finally:
+                close_spool(fh)
+                slots.release()
+            progress_reporter.report(status, get_text('zip_packing', lang, name=name, done=done, total=len(files),
+                                                      bar=make_bar(int(done / len(files) * 100))))
+        if parts.zf is not None: await upload_part()
+        return tg_ids, failed
+    finally:
+        for t in tasks:
+            # Files that finished downloading but were never packed (the ZIP was aborted)
+            if not t.cancel() and not t.cancelled() and t.result()[1] is not None and not t.result()[1].closed:
+                close_spool(t.result()[1])
+        parts.discard()
+        await progress_reporter.done(status)
+
+async def handle_folder_download(update, folder_id):
+    DOWNLOADS_ACTIVE.add(1)
+    try:
+        query = update.callback_query
+        lang = query.from_user.language_code.split('-')[0] if query.from_user.language_code else 'en'
+        await query.answer(get_text('starting', lang), show_alert=False)
+        link = f"https://drive.google.com/drive/folders/{folder_id}"
+        status = await query.message.reply_text(get_text('fetching', lang))
 
-            await status.delete()
+        try:
+            files = await run_drive(list_folder_files, folder_id)
         except Exception as e:
+            logging.error(f"API Error: {e}")
+            await status.edit_text(get_text(drive_error_key(), lang))
+            return
+        if not files:
+            await status.edit_text(get_text('zip_empty', lang))
+            return
+
+        if folder_id == ROOT_FOLDER_ID: name = "Perfection In Physics"
+        else: name = folder_tree.name(folder_id, "Folder")
+        version = folder_version(files)
+        # Single files over the limit can't go in any part
+        limit = MAX_UPLOAD_BYTES - ZIP_PART_MARGIN
+        fitting = [f for f in files if int(f.get('size', 0)) <= limit]
+
+        # 1. CACHE HIT: the same folder content was zipped before
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, store.get_folder_zip, folder_id)
+        CACHE_LOOKUPS.inc("zip_hit" if cached and cached[0] == version else "zip_miss")
+        if cached and cached[0] == version:
+            try:
+                await send_zip_parts(query, cached[1], name, lang)
+                await status.delete()
+                return
+            except Exception as e:
+                logging.warning(f"Cached ZIP failed: {e}")
+                await loop.run_in_executor(None, store.delete_folder_zip, folder_id)
+
+        # 2. SIZE CHECK
+        if not fitting or sum(int(f.get('size', 0)) for f in fitting) > ZIP_MAX_PARTS * limit:
+            await status.edit_text(get_text('zip_too_large', lang, link=link, limit=f"{ZIP_MAX_PARTS} x {UPLOAD_LIMIT_LABEL}"),
+                                   parse_mode='Markdown')
+            return
+
+        # 3. QUEUE THE ZIP (or join one already running for this folder version)
+        def on_position(pos):
+            progress_reporter.report(status, get_text('queued', lang, name=name, pos=pos))
+
+        async def run():
+            tg_ids, failed = await zip_folder(query, status, folder_id, name, fitting, lang)
+            # A ZIP missing files is sent but not cached, so the next request tries again
+            if not failed and tg_ids:
+                await loop.run_in_executor(None, store.put_folder_zip, folder_id, version, tg_ids, time.time())
+            logging.info(f"📦 Zipped {name}: {len(fitting) - failed} files in {len(tg_ids)} part(s)")
+            return tg_ids, failed
+
+        future, is_leader = download_scheduler.submit(query.from_user.id, f"zip:{folder_id}:{version}", run, on_position)
+        if is_leader:
+            # The parts are already in the chat; only the status message is left to settle
+            tg_ids, failed = await future or ([], 0)
+            skipped = failed + len(files) - len(fitting)
+            await progress_reporter.done(status)
+            try:
+                if not tg_ids: await status.edit_text(get_text('ul_failed', lang, link=link), parse_mode='Markdown')
+                elif skipped: await status.edit_text(get_text('zip_skipped', lang, count=skipped, link=link), parse_mode='Markdown')
+                else: await status.delete()
+            except: pass
+            return
+
+        progress_reporter.report(status, get_text('waiting_same', lang, name=name))
+        tg_ids, _ = await future or ([], 0)
+        await progress_reporter.done(status)
+        try:
+            if not tg_ids: raise RuntimeError("shared ZIP failed")
+            await send_zip_parts(query, tg_ids, name, lang)
+            await status.delete()
+        except Exception:
             try:
                 await status.edit_text(get_text('ul_failed', lang, link=link), parse_mode='Markdown')
             except: pass
 
     except asyncio.CancelledError:
         return
+    finally:
+        DOWNLOADS_ACTIVE.add(-1)
+
+async def send_zip_parts(query, parts, name, lang):
+    for number, (tg_id, count) in enumerate(parts, 1):
+        part = get_text('zip_part', lang, part=number) if len(parts) > 1 else ""
+        await query.message.reply_document(document=tg_id, parse_mode='Markdown',
+                                           caption=get_text('zip_caption', lang, name=name, count=count, part=part))
+
+# --- CACHE VALIDATION ---
+validating = set()
+
+def mark_stale(file_id):
+    """Drops an outdated upload. The new version is left to prewarm_loop, which re-uploads it
+    within PREWARM_HOURS and the daily budget, ranked with its recent-change bonus."""
+    forget_file_id(file_id)
+    recent_changes[file_id] = time.time()
+    recent_changes.move_to_end(file_id)
+
+def check_cached_changes(changes):
+    for ch in changes:
+        file_id = ch.get('fileId')
+        entry = file_id_cache.get(file_id)
+        if not entry: continue
+        meta = ch.get('file')
+        if ch.get('removed') or not meta or meta.get('trashed'):
+            forget_file_id(file_id)
+        elif entry_is_stale(entry, meta):
+            mark_stale(file_id)
+        elif entry.get('name') and entry['name'] != file_display_name(meta):
+            cache_file_id(file_id, entry['tg_file_id'], dict(meta, webViewLink=entry.get('link')))
+
+async def validate_cached(file_id):
+    """Lazy freshness check after a cache hit, at most once per CACHE_VALIDATE_AFTER per file"""
+    entry = file_id_cache.get(file_id)
+    if not entry or file_id in validating: return
+    if time.time() - (entry.get('checked_at') or 0) < CACHE_VALIDATE_AFTER: return
+    validating.add(file_id)
+    try:
+        meta_res = await run_drive(get_meta_worker, file_id, lane=BACKGROUND)
+        if meta_res['status'] != 'ok': return
+        meta = meta_res['meta']
+        if entry_is_stale(entry, meta):
+            logging.info(f"♻️ Cached upload of {file_id} is outdated")
+            mark_stale(file_id)
+        else:
+            cache_file_id(file_id, entry['tg_file_id'], meta)
+    except Exception as e:
+        logging.warning(f"Cache Validation Error ({file_id}): {e}")
+    finally:
+        validating.discard(file_id)
+
+# --- CACHE PRE-WARMING ---
+PREWARM_USER = "prewarm"   # scheduler lane shared by all pre-warm jobs
+
+def in_prewarm_window(hour):
+    start, end = (int(h) for h in PREWARM_HOURS.split('-'))
+    if start <= end: return start <= hour < end
+    return hour >= start or hour < end
+
+def prewarm_candidates(now, top_hits):
+    """Uncached files ordered by decayed popularity plus a bonus for recent Drive changes"""
+    scores = {}
+    for drive_id, hits, last_hit in top_hits:
+        # Requests lose half their weight per week of silence
+        scores[drive_id] = hits * 0.5 ** ((now - last_hit) / (7 * 86400))
+    for drive_id, changed_at in list(recent_changes.items()):
+        scores[drive_id] = scores.get(drive_id, 0) + PREWARM_RECENT_WEIGHT * 0.5 ** ((now - changed_at) / 86400)
+    return sorted((d for d in scores if d not in file_id_cache), key=scores.get, reverse=True)
+
+async def prewarm_file(bot, file_id, budget):
+    """Uploads one file to PREWARM_CHAT_ID through the scheduler; returns bytes spent"""
+    meta_res = await run_drive(get_meta_worker, file_id, lane=BACKGROUND)
+    if meta_res['status'] != 'ok': return 0
+    meta = meta_res['meta']
+    size = int(meta.get('size', 0))
+    if size > MAX_UPLOAD_BYTES or size > budget: return 0
+    name = file_display_name(meta)
+    spent = 0
+
+    async def run():
+        nonlocal spent
+        fh, spent = await download_to_spool(file_id, meta, lane=BACKGROUND)
+        try:
+            started = time.perf_counter()
+            sent_msg = await bot.send_document(
+                chat_id=PREWARM_CHAT_ID,
+                document=upload_source(fh, spent, name),
+                disable_notification=True,
+                read_timeout=UPLOAD_TIMEOUT,
+                write_timeout=UPLOAD_TIMEOUT,
+                connect_timeout=300
+            )
+            observe_transfer("upload", spent, time.perf_counter() - started)
+            if not sent_msg.document: return None
+            cache_file_id(file_id, sent_msg.document.file_id, meta)
+            return sent_msg.document.file_id
+        finally:
+            close_spool(fh)
+
+    # Same queue as user requests: respects the worker limits and coalesces with live downloads
+    future, _ = download_scheduler.submit(PREWARM_USER, file_id, run, lambda pos: None)
+    await future
+    return spent
+
+async def prewarm_loop(bot):
+    budget_total = PREWARM_BUDGET_MB * 1024 * 1024
+    skipped = set()
+    while True:
+        await asyncio.sleep(PREWARM_INTERVAL)
+        now = datetime.now(timezone.utc)
+        if not in_prewarm_window(now.hour): continue
+
+        # Budget is per UTC day and survives restarts
+        today = now.strftime("%Y-%m-%d")
+        if store.get_meta('prewarm_day') != today:
+            store.set_meta('prewarm_day', today)
+            store.set_meta('prewarm_bytes', '0')
+            skipped.clear()
+        used = int(store.get_meta('prewarm_bytes', '0'))
+
+        warmed = 0
+        top_hits = await asyncio.get_running_loop().run_in_executor(None, store.top_hits, 200)
+        for file_id in prewarm_candidates(now.timestamp(), top_hits):
+            if used >= budget_total or not in_prewarm_window(datetime.now(timezone.utc).hour): break
+            if file_id in skipped: continue
+            try:
+                spent = await prewarm_file(bot, file_id, budget_total - used)
+            except Exception as e:
+                logging.error(f"Prewarm Error ({file_id}): {e}")
+                spent = 0
+            if not spent or file_id not in file_id_cache:
+                skipped.add(file_id)
+                continue
+            used += spent
+            warmed += 1
+            store.set_meta('prewarm_bytes', str(used))
+        if warmed:
+            logging.info(f"🔥 Pre-warmed {warmed} files ({format_size(used)} of today's budget used)")
+
+# --- BROADCAST ---
+class AsyncRateLimiter:
+    """Token bucket shared by concurrent senders; pause() stops everyone (e.g. on 429)"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def prune_user(user_id):
+    subscribed_users.discard(user_id)
+    store.remove_user(user_id)
+
+async def run_broadcast(bot, broadcast_id, text):
+    """Delivers one broadcast to every subscriber not yet checkpointed, then marks it finished"""
+    limiter = AsyncRateLimiter(BROADCAST_RATE, BROADCAST_RATE)
+    already = await asyncio.get_running_loop().run_in_executor(None, store.broadcast_sent_users, broadcast_id)
+    queue = asyncio.Queue()
+    for user_id in sorted(subscribed_users - already):
+        queue.put_nowait(user_id)
+    total = queue.qsize()
+    counts = {"sent": 0, "pruned": 0, "failed": 0}
+    logging.info(f"📢 Broadcast #{broadcast_id}: {total} users left ({len(already)} already done)")
+
+    async def sender():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            outcome = "failed"
+            for attempt in range(3):
+                await limiter.acquire()
+                try:
+                    await bot.send_message(chat_id=user_id, text=text)
+                    outcome = "sent"
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                    limiter.pause(delay)
+                    continue
+                except Forbidden:
+                    # Blocked the bot or deactivated: stop messaging them on every boot
+                    prune_user(user_id)
+                    outcome = "pruned"
+                except BadRequest as e:
+                    if "chat not found" in str(e).lower():
+                        prune_user(user_id)
+                        outcome = "pruned"
+                except Exception as e:
+                    logging.warning(f"Broadcast Error ({user_id}): {e}")
+                break
+            counts[outcome] += 1
+            # Only settled users are checkpointed; a failed one is retried if the broadcast resumes
+            if outcome != "failed": store.mark_broadcast_sent(broadcast_id, user_id)
+
+    await asyncio.gather(*(sender() for _ in range(BROADCAST_CONCURRENCY)))
+    await asyncio.get_running_loop().run_in_executor(None, store.finish_broadcast, broadcast_id, time.time())
+    logging.info(f"✅ Broadcast #{broadcast_id} complete: {counts['sent']} sent, {counts['pruned']} pruned, {counts['failed']} failed")
+
+async def broadcast_loop(bot):
+    # Let polling come up first; broadcasting never delays the first replies
+    await asyncio.sleep(BROADCAST_DELAY)
+    while True:
+        active = await asyncio.get_running_loop().run_in_executor(None, store.active_broadcast)
+        if active is None: return
+        try:
+            await run_broadcast(bot, *active)
+        except Exception as e:
+            logging.error(f"Broadcast #{active[0]} stopped: {e}")
+            return
+
+# --- STARTUP ---
+# boot() loads everything Drive and the store need in a thread while Telegram's own startup
+# (getMe, deleteWebhook, first getUpdates) is in flight; handlers wait for it only if they must
+startup_times = OrderedDict()   # phase -> seconds; *_at entries are offsets from launch
+startup_times['module_load'] = time.perf_counter() - BOOT_STARTED
+boot_future = None
+metrics.Gauge("startup_seconds", "Where cold-start time went", ("phase",),
+              fn=lambda: {(k,): round(v, 3) for k, v in startup_times.items()})
+
+def boot():
+    global creds, drive_pool, store, disk_cache
+    started = time.perf_counter()
+    def phase(name):
+        nonlocal started
+        now = time.perf_counter()
+        startup_times[name] = now - started
+        started = now
+
+    creds = load_credentials()
+    phase('credentials')
+    if creds:
+        drive_pool = DriveClientPool(creds)
+        drive_discovery()
+        from googleapiclient.http import MediaIoBaseDownload  # noqa: F401 (warm for the first download)
+        phase('drive_client')
+
+    store = Store(STORE_FILE)
+    store.migrate_json(CACHE_FILE, USERS_FILE)
+    file_id_cache.update(store.load_file_ids())
+    subscribed_users.update(store.load_users())
+    phase('store')
+
+    if DISK_CACHE_MB > 0:
+        disk_cache = DiskCache(DISK_CACHE_DIR, DISK_CACHE_MB * 1024 * 1024)
+        phase('disk_cache')
+
+    folder_tree.load(store.load_folders())
+    if search_index.load():
+        logging.info(f"🔎 Search index loaded: {len(search_index.items)} items")
+    phase('indexes')
+    startup_times['boot_done_at'] = time.perf_counter() - BOOT_STARTED
+
+def start_boot():
+    global boot_future
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="boot")
+    boot_future = pool.submit(boot)
+    pool.shutdown(wait=False)
+
+async def boot_ready():
+    if not boot_future.done():
+        await asyncio.wrap_future(boot_future)
+    boot_future.result()
+
+async def ensure_ready():
+    """Awaited by every handler; the first one after launch also logs the startup report"""
+    await boot_ready()
+    if 'first_update_at' not in startup_times:
+        startup_times['first_update_at'] = time.perf_counter() - BOOT_STARTED
+        logging.info("🚀 Startup: " + ", ".join(f"{k} {v:.2f}s" for k, v in startup_times.items()))
+
+# --- UPDATE PROCESSING ---
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Handles updates concurrently but strictly in arrival order within a chat. At most `workers`
+    handlers run at once; an update waiting behind its own chat doesn't hold a worker slot.
+    max_concurrent_updates (the base semaphore) bounds how many updates are in flight."""
+    def __init__(self, inflight_limit, workers):
+        super().__init__(inflight_limit)
+        self.workers = asyncio.Semaphore(workers)
+        self.chats = {}              # chat_id -> [asyncio.Lock, updates queued or running for the chat]
+        self.admitted = set()        # update_ids let in by the webhook and not finished yet
+        self.admit_lock = threading.Lock()
+        self.running = 0
+
+    def admit(self, update_id):
+        """Thread-safe webhook gate: False once UPDATE_INFLIGHT_LIMIT updates are in flight"""
+        with self.admit_lock:
+            if len(self.admitted) >= self.max_concurrent_updates: return False
+            self.admitted.add(update_id)
+            return True
+
+    async def _run(self, coroutine):
+        async with self.workers:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, 'effective_chat', None)
+        try:
+            if chat is None:
+                await self._run(coroutine)
+                return
+            slot = self.chats.setdefault(chat.id, [asyncio.Lock(), 0])
+            slot[1] += 1
+            try:
+                async with slot[0]:
+                    await self._run(coroutine)
+            finally:
+                slot[1] -= 1
+                if not slot[1]: del self.chats[chat.id]
+        finally:
+            with self.admit_lock:
+                self.admitted.discard(getattr(update, 'update_id', None))
+
+    async def initialize(self): pass
+
+    async def shutdown(self): pass
+
+update_processor = ChatOrderedProcessor(UPDATE_INFLIGHT_LIMIT, UPDATE_WORKERS)
+metrics.Gauge("updates_in_flight", "Updates by processing state", ("state",),
+              fn=lambda: {("admitted",): len(update_processor.admitted), ("running",): update_processor.running,
+                          ("chats",): len(update_processor.chats)})
+
+# --- WEBHOOK ---
+webhook_app = None    # set while serve_webhook runs
+webhook_loop = None
+record_lock = threading.Lock()
+
+def accept_webhook(data, headers):
+    """Runs on keep_alive's Flask thread for every POST from Telegram; returns (status, body)"""
+    if WEBHOOK_SECRET and headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        WEBHOOK_UPDATES.inc("forbidden")
+        return 403, "forbidden"
+    app, loop = webhook_app, webhook_loop
+    if app is None or loop is None:
+        WEBHOOK_UPDATES.inc("starting")
+        return 503, "starting"
+    if not isinstance(data, dict) or 'update_id' not in data:
+        WEBHOOK_UPDATES.inc("invalid")
+        return 400, "bad update"
+    # Over the limit Telegram gets a 503 and redelivers later, so a burst waits at Telegram, not in our memory
+    if not update_processor.admit(data['update_id']):
+        WEBHOOK_UPDATES.inc("shed")
+        return 503, "busy"
+    if WEBHOOK_RECORD_FILE:
+        with record_lock, open(WEBHOOK_RECORD_FILE, "a") as f:
+            f.write(json.dumps(data) + "\n")
+    update = Update.de_json(data, app.bot)
+    loop.call_soon_threadsafe(app.update_queue.put_nowait, update)
+    WEBHOOK_UPDATES.inc("accepted")
+    return 200, "ok"
+
+async def serve_webhook(app):
+    """Webhook mode: Telegram POSTs updates to keep_alive's server instead of us polling getUpdates"""
+    global webhook_app, webhook_loop
+    async with app:
+        await post_init(app)
+        await app.start()
+        webhook_app, webhook_loop = app, asyncio.get_running_loop()
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                                      allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        logging.info(f"🪝 Webhook mode: listening on {WEBHOOK_PATH}" + ("" if WEBHOOK_URL else " (not registered with Telegram)"))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            webhook_app = webhook_loop = None
+            await app.stop()
+            await post_shutdown(app)
 
 # --- HANDLERS ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await ensure_ready()
     register_user(update.effective_chat.id)
     lang = update.effective_user.language_code.split('-')[0] if update.effective_user.language_code else 'en'
 
     welcome_text = get_text('welcome', lang)
 
-    files = get_files(ROOT_FOLDER_ID)
+    files, complete = await list_folder(ROOT_FOLDER_ID, wait=False)
     if files is None:
-        await update.message.reply_text(get_text('error_drive', lang))
+        await update.message.reply_text(get_text(drive_error_key(), lang))
     else:
         await update.message.reply_text(welcome_text, parse_mode='Markdown')
-        await send_menu(update, files, ROOT_FOLDER_ID, 0, False, None)
+        await send_menu(update, files, ROOT_FOLDER_ID, 0, False, None, complete)
 
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await ensure_ready()
     register_user(update.effective_chat.id)
     lang = update.effective_user.language_code.split('-')[0] if update.effective_user.language_code else 'en'
 
@@ -520,17 +2638,26 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     q = " ".join(context.args)
     msg = await update.message.reply_text(get_text('searching', lang, q=q), parse_mode='Markdown')
-    res = search_drive(q)
+    if search_index.ready:
+        res = await asyncio.get_running_loop().run_in_executor(None, search_index.search, q)
+    else:
+        # Index still crawling on first boot: fall back to Drive's own search
+        try:
+            res = await run_drive(search_drive, q)
+        except asyncio.TimeoutError:
+            res = []
     if not res: await msg.edit_text(get_text('no_results', lang))
     else:
-        search_cache[q] = res
-        await send_menu(update, res, q, 0, True, msg)
+        token = search_token(q)
+        search_results.put(token, SearchResult(q, res))
+        await send_menu(update, res, token, 0, True, msg, query=q)
 
 async def btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    await ensure_ready()
     register_user(q.from_user.id)
 
-    if "DL|" not in q.data:
+    if not q.data.startswith(("DL|", "ZIP|")):
         try: await q.answer()
         except: pass
 
@@ -538,40 +2665,78 @@ async def btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "IGNORE": return
 
     if "DL|" in data:
-        task = asyncio.create_task(handle_download(update, data.split("|")[1]))
-        background_tasks.add(task)
-        task.add_done_callback(background_tasks.discard)
+        spawn(handle_download(update, data.split("|")[1]))
+
+    elif data.startswith("ZIP|"):
+        spawn(handle_folder_download(update, data.split("|")[1]))
 
     elif "PAGE|" in data:
         is_search = "SPAGE" in data
         parts = data.split("|")
         ctx_id, pg = parts[1], int(parts[2])
-        files = search_cache.get(ctx_id) if is_search else get_files(ctx_id)
-        if files: await send_menu(update, files, ctx_id, pg, is_search, q.message)
+        query = None
+        if is_search:
+            result = search_results.get(ctx_id)
+            if result is None:
+                await reply_notice(q, 'search_expired')
+                return
+            files, query = result.files, result.query
+        else:
+            files, _ = await list_folder(ctx_id)
+            if files is None: await reply_notice(q, drive_error_key())
+        if files: await send_menu(update, files, ctx_id, pg, is_search, q.message, query=query)
 
     elif "OPEN|" in data:
         tid = data.split("|")[1]
-        files = get_files(tid)
-        if files: await send_menu(update, files, tid, 0, False, q.message)
+        files, complete = await list_folder(tid, wait=False)
+        if files is None: await reply_notice(q, drive_error_key())
+        if files: await send_menu(update, files, tid, 0, False, q.message, complete)
+
+async def reply_notice(q, key):
+    lang = q.from_user.language_code.split('-')[0] if q.from_user.language_code else 'en'
+    try: await q.message.reply_text(get_text(key, lang))
+    except: pass
 
 async def post_init(app):
-    await app.bot.set_my_commands([
+    startup_times['telegram_ready_at'] = time.perf_counter() - BOOT_STARTED
+    progress_reporter.start()
+    spawn(measure_loop_lag())
+    # Not awaited: polling shouldn't wait on one more Bot API round trip
+    spawn(app.bot.set_my_commands([
         BotCommand("start", "🏠 Home"),
         BotCommand("search", "🔍 Search Files")
-    ])
+    ]))
+    spawn(start_background_jobs(app.bot))
 
-    if subscribed_users:
-        print(f"📢 Broadcasting to {len(subscribed_users)} users...")
-        for user_id in subscribed_users:
-            try:
-                await app.bot.send_message(chat_id=user_id, text="Perfection In Physics Bot Back ❤")
-                await asyncio.sleep(0.05)
-            except Exception: pass
-        print(f"✅ Broadcast complete.")
+async def start_background_jobs(bot):
+    """Jobs that need the store or Drive, started once boot() is done"""
+    await boot_ready()
+    spawn(flush_store())
+
+    if creds:
+        spawn(watch_changes())
+
+    if creds and PREWARM_CHAT_ID:
+        spawn(prewarm_loop(bot))
+
+    spawn(start_broadcast(bot))
+
+async def start_broadcast(bot):
+    # An unfinished broadcast from before a restart is resumed rather than started over
+    loop = asyncio.get_running_loop()
+    if BROADCAST_ON_START and subscribed_users and await loop.run_in_executor(None, store.active_broadcast) is None:
+        await loop.run_in_executor(None, store.create_broadcast, "Perfection In Physics Bot Back ❤", time.time())
+    await broadcast_loop(bot)
+
+async def post_shutdown(app):
+    # Commit whatever the periodic flush hasn't picked up yet
+    if boot_future and boot_future.done() and store: store.close()
 
 if __name__ == '__main__':
-    # START KEEP ALIVE SERVER BEFORE THE BOT
+    # START KEEP ALIVE SERVER BEFORE THE BOT (routes must exist before it serves)
+    if WEBHOOK_MODE: add_webhook(WEBHOOK_PATH, accept_webhook)
     keep_alive()
+    start_boot()
 
     if not TOKEN:
         print("❌ CRITICAL ERROR: Token not found. Bot cannot start.")
@@ -583,14 +2748,20 @@ if __name__ == '__main__':
             connect_timeout=60
         )
 
-        app = ApplicationBuilder().token(TOKEN).request(request).post_init(post_init).build()
+        builder = (ApplicationBuilder().token(TOKEN).request(request).concurrent_updates(update_processor)
+                   .post_init(post_init).post_shutdown(post_shutdown))
+        if LOCAL_BOT_API_URL:
+            # Self-hosted Bot API server: 2 GB uploads and file:// paths instead of multipart bodies
+            builder = builder.base_url(f"{LOCAL_BOT_API_URL}/bot").base_file_url(f"{LOCAL_BOT_API_URL}/file/bot").local_mode(True)
+        app = builder.build()
         app.add_handler(CommandHandler("start", start))
         app.add_handler(CommandHandler("search", search))
         app.add_handler(CallbackQueryHandler(btn))
         print("✅ Bot is online!")
 
         try:
-            app.run_polling(drop_pending_updates=True)
+            if WEBHOOK_MODE: asyncio.run(serve_webhook(app))
+            else: app.run_polling(drop_pending_updates=True)
         except KeyboardInterrupt:
             print("\n🛑 Bot stopped by user.")
         except Exception as e:
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+class DiskCache:
+    """Size-capped LRU of downloaded Drive bytes on local disk, one file per content key.
+
+    Entries are written under a .tmp name and renamed into place once complete, so a crash
+    never leaves a partial entry behind. Safe to call from any thread.
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # file name -> size, least recently used first
+        self.total = 0
+        os.makedirs(path, exist_ok=True)
+        found = []
+        for entry in os.scandir(path):
+            if not entry.is_file(): continue
+            if entry.name.endswith('.tmp'):
+                os.unlink(entry.path)   # interrupted write
+                continue
+            st = entry.stat()
+            found.append((st.st_mtime, entry.name, st.st_size))
+        # mtime is bumped on every hit, so it restores the LRU order across restarts
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+        self._evict()
+        logging.info(f"💽 Disk cache: {len(self.entries)} files, {self.total / 1024 / 1024:.1f} MB in {path}")
+
+    def _name(self, key):
+        return hashlib.blake2s(key.encode(), digest_size=16).hexdigest()
+
+    def _add(self, name, size):
+        with self.lock:
+            self.total += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            self._evict()
+
+    def _evict(self):
+        while self.total > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                # Handles already open on the entry keep reading it
+                os.unlink(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    # --- READS ---
+    def open(self, key):
+        """Read handle on the cached entry for key, or None; the caller closes it"""
+        name = self._name(key)
+        with self.lock:
+            if name not in self.entries: return None
+            self.entries.move_to_end(name)
+        path = os.path.join(self.path, name)
+        try:
+            fh = open(path, 'rb')
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+        return fh
+
+    def __len__(self):
+        return len(self.entries)
+
+    # --- WRITES ---
+    def create(self):
+        """Writable temp file inside the cache directory; finish it with commit() or discard()"""
+        return tempfile.NamedTemporaryFile(dir=self.path, suffix='.tmp', delete=False)
+
+    def commit(self, fh, key):
+        """Moves a finished, flushed create() file into place under key. fh stays open for the
+        caller; if the file can't be cached it is unlinked, so it lives only as long as fh."""
+        size = os.fstat(fh.fileno()).st_size
+        if size > self.max_bytes:
+            self._unlink(fh.name)
+            return
+        name = self._name(key)
+        try:
+            os.replace(fh.name, os.path.join(self.path, name))
+        except OSError:
+            self._unlink(fh.name)
+            raise
+        self._add(name, size)
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def discard(self, fh):
+        fh.close()
+        self._unlink(fh.name)
+
+    def add_file(self, path, key):
+        """Caches a finished file kept elsewhere: a hard link when it's on the same filesystem, else a copy"""
+        size = os.path.getsize(path)
+        if size > self.max_bytes: return
+        name = self._name(key)
+        tmp = os.path.join(self.path, f"{name}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.link(path, tmp)
+            except OSError:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, os.path.join(self.path, name))
+        except OSError:
+            self._unlink(tmp)   # a half-written copy would only fill the disk further
+            raise
+        self._add(name, size)
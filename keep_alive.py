@@ -1,15 +1,28 @@
-from flask import Flask
+from flask import Flask, Response, request
 from threading import Thread
 
+import metrics
+
 app = Flask('')
 
 @app.route('/')
 def home():
     return "I am alive"
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def add_webhook(path, handler):
+    """Serves handler(json_body, headers) -> (status, body) for POSTs to path; call before keep_alive()"""
+    def webhook():
+        status, body = handler(request.get_json(silent=True), request.headers)
+        return Response(body, status=status, mimetype='text/plain')
+    app.add_url_rule(path, 'webhook', webhook, methods=['POST'])
+
 def run():
     app.run(host='0.0.0.0', port=8080)
 
 def keep_alive():
     t = Thread(target=run)
-    t.start()
\ No newline at end of file
+    t.start()
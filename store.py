@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+# Everything needed to answer a cache hit without asking Drive
+FILE_COLUMNS = ('tg_file_id', 'name', 'size', 'mime_type', 'modified_time', 'md5', 'link', 'checked_at')
+
+class Store:
+    """SQLite (WAL) home for the Telegram file_id cache and the subscriber list.
+
+    Writes are buffered in memory and committed in one transaction by flush(),
+    which the bot calls off the event loop on a timer and at shutdown. Two locks:
+    `lock` guards only the in-memory buffers (cheap, fine on the event loop);
+    `db_lock` guards the connection, so anything that takes it belongs in an executor.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS file_ids (drive_id TEXT PRIMARY KEY, tg_file_id TEXT NOT NULL,
+                name TEXT, size INTEGER, mime_type TEXT, modified_time TEXT, md5 TEXT, link TEXT, checked_at REAL);
+            CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS file_hits (drive_id TEXT PRIMARY KEY, hits INTEGER NOT NULL, last_hit REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS folders (folder_id TEXT PRIMARY KEY, name TEXT NOT NULL, parent_id TEXT);
+            CREATE TABLE IF NOT EXISTS broadcasts (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL,
+                created_at REAL NOT NULL, finished_at REAL);
+            CREATE TABLE IF NOT EXISTS broadcast_sent (broadcast_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+                PRIMARY KEY (broadcast_id, user_id));
+            CREATE TABLE IF NOT EXISTS folder_zips (folder_id TEXT PRIMARY KEY, version TEXT NOT NULL,
+                parts TEXT NOT NULL, created_at REAL NOT NULL);
+        """)
+        # Databases created before the metadata columns existed
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(file_ids)")}
+        for column in FILE_COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE file_ids ADD COLUMN {column}")
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        # The meta table is a handful of keys: kept in memory so get_meta never waits on SQLite
+        self.meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        self.pending_meta = {}    # key -> value
+        self.pending_files = {}   # drive_id -> entry dict, or None to delete
+        self.pending_users = {}   # user_id -> True to add, False to remove
+        self.pending_hits = {}    # drive_id -> [hits, last_hit]
+        self.pending_folders = {} # folder_id -> (name, parent_id), or None to delete
+        self.pending_sent = set() # (broadcast_id, user_id) delivery checkpoints
+
+    # --- READS ---
+    def load_file_ids(self):
+        """{drive_id: {column: value}} for every cached upload"""
+        with self.db_lock:
+            rows = self.conn.execute(f"SELECT drive_id, {', '.join(FILE_COLUMNS)} FROM file_ids")
+            return {row[0]: dict(zip(FILE_COLUMNS, row[1:])) for row in rows}
+
+    def load_users(self):
+        with self.db_lock:
+            return {row[0] for row in self.conn.execute("SELECT user_id FROM users")}
+
+    def load_folders(self):
+        """[(folder_id, name, parent_id)] for the whole persisted folder tree"""
+        with self.db_lock:
+            return self.conn.execute("SELECT folder_id, name, parent_id FROM folders").fetchall()
+
+    def top_hits(self, limit):
+        """[(drive_id, hits, last_hit)] for the most requested files"""
+        with self.db_lock:
+            return self.conn.execute(
+                "SELECT drive_id, hits, last_hit FROM file_hits ORDER BY hits DESC LIMIT ?", (limit,)).fetchall()
+
+    def active_broadcast(self):
+        """(id, text) of the oldest unfinished broadcast, or None"""
+        with self.db_lock:
+            return self.conn.execute(
+                "SELECT id, text FROM broadcasts WHERE finished_at IS NULL ORDER BY id LIMIT 1").fetchone()
+
+    def broadcast_sent_users(self, broadcast_id):
+        with self.db_lock:
+            rows = self.conn.execute("SELECT user_id FROM broadcast_sent WHERE broadcast_id = ?", (broadcast_id,))
+            done = {row[0] for row in rows}
+        with self.lock:
+            return done | {u for b, u in self.pending_sent if b == broadcast_id}
+
+    def create_broadcast(self, text, when):
+        with self.db_lock:
+            return self.conn.execute(
+                "INSERT INTO broadcasts (text, created_at) VALUES (?, ?)", (text, when)).lastrowid
+
+    def finish_broadcast(self, broadcast_id, when):
+        self.flush()
+        with self.db_lock, self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("UPDATE broadcasts SET finished_at = ? WHERE id = ?", (when, broadcast_id))
+            self.conn.execute("DELETE FROM broadcast_sent WHERE broadcast_id = ?", (broadcast_id,))
+
+    def get_folder_zip(self, folder_id):
+        """(content version, [[tg_file_id, file count] per part]) of the last ZIP sent for a folder, or None"""
+        with self.db_lock:
+            row = self.conn.execute("SELECT version, parts FROM folder_zips WHERE folder_id = ?", (folder_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put_folder_zip(self, folder_id, version, parts, when):
+        with self.db_lock:
+            self.conn.execute("INSERT OR REPLACE INTO folder_zips (folder_id, version, parts, created_at) VALUES (?, ?, ?, ?)",
+                              (folder_id, version, json.dumps(parts), when))
+
+    def delete_folder_zip(self, folder_id):
+        with self.db_lock:
+            self.conn.execute("DELETE FROM folder_zips WHERE folder_id = ?", (folder_id,))
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            return self.meta.get(key, default)
+
+    # --- BUFFERED WRITES ---
+    def set_meta(self, key, value):
+        with self.lock:
+            self.meta[key] = value
+            self.pending_meta[key] = value
+
+    def put_file_id(self, drive_id, entry):
+        with self.lock:
+            self.pending_files[drive_id] = dict(entry)
+
+    def delete_file_id(self, drive_id):
+        with self.lock:
+            self.pending_files[drive_id] = None
+
+    def add_user(self, user_id):
+        with self.lock:
+            self.pending_users[user_id] = True
+
+    def remove_user(self, user_id):
+        with self.lock:
+            self.pending_users[user_id] = False
+
+    def record_hit(self, drive_id, when):
+        with self.lock:
+            hit = self.pending_hits.setdefault(drive_id, [0, when])
+            hit[0] += 1
+            hit[1] = when
+
+    def put_folder(self, folder_id, name, parent_id):
+        with self.lock:
+            self.pending_folders[folder_id] = (name, parent_id)
+
+    def delete_folder(self, folder_id):
+        with self.lock:
+            self.pending_folders[folder_id] = None
+
+    def mark_broadcast_sent(self, broadcast_id, user_id):
+        with self.lock:
+            self.pending_sent.add((broadcast_id, user_id))
+
+    def flush(self):
+        """Commits every buffered write atomically; returns the number of rows touched"""
+        # db_lock first: one flush at a time, so batches commit in the order they were taken
+        with self.db_lock:
+            with self.lock:
+                files, self.pending_files = self.pending_files, {}
+                users, self.pending_users = self.pending_users, {}
+                hits, self.pending_hits = self.pending_hits, {}
+                folders, self.pending_folders = self.pending_folders, {}
+                sent, self.pending_sent = self.pending_sent, set()
+                meta, self.pending_meta = self.pending_meta, {}
+            if not files and not users and not hits and not folders and not sent and not meta: return 0
+            # Buffered writes keep landing in the fresh buffers while this commits
+            try:
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.executemany(
+                        f"INSERT OR REPLACE INTO file_ids (drive_id, {', '.join(FILE_COLUMNS)}) "
+                        f"VALUES (?{', ?' * len(FILE_COLUMNS)})",
+                        [(k, *(v.get(c) for c in FILE_COLUMNS)) for k, v in files.items() if v is not None])
+                    self.conn.executemany(
+                        "DELETE FROM file_ids WHERE drive_id = ?",
+                        [(k,) for k, v in files.items() if v is None])
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                        [(k,) for k, v in users.items() if v])
+                    self.conn.executemany(
+                        "DELETE FROM users WHERE user_id = ?",
+                        [(k,) for k, v in users.items() if not v])
+                    self.conn.executemany(
+                        "INSERT INTO file_hits (drive_id, hits, last_hit) VALUES (?, ?, ?) "
+                        "ON CONFLICT(drive_id) DO UPDATE SET hits = hits + excluded.hits, last_hit = excluded.last_hit",
+                        [(k, n, t) for k, (n, t) in hits.items()])
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO folders (folder_id, name, parent_id) VALUES (?, ?, ?)",
+                        [(k, *v) for k, v in folders.items() if v is not None])
+                    self.conn.executemany(
+                        "DELETE FROM folders WHERE folder_id = ?",
+                        [(k,) for k, v in folders.items() if v is None])
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO broadcast_sent (broadcast_id, user_id) VALUES (?, ?)", sent)
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+            except sqlite3.Error:
+                # Put the batch back (newer writes win) so the next flush retries it
+                with self.lock:
+                    files.update(self.pending_files)
+                    users.update(self.pending_users)
+                    folders.update(self.pending_folders)
+                    meta.update(self.pending_meta)
+                    for k, (n, t) in self.pending_hits.items():
+                        hit = hits.setdefault(k, [0, t])
+                        hit[0] += n
+                        hit[1] = t
+                    self.pending_files, self.pending_users, self.pending_hits = files, users, hits
+                    self.pending_folders, self.pending_meta = folders, meta
+                    self.pending_sent |= sent
+                raise
+            return len(files) + len(users) + len(hits) + len(folders) + len(sent) + len(meta)
+
+    # --- MIGRATION ---
+    def migrate_json(self, cache_file, users_file):
+        """One-time import of the old file_ids.json / users.json"""
+        if self.get_meta('json_migrated'): return False
+        try:
+            with open(cache_file, "r") as f:
+                for drive_id, tg_file_id in json.load(f).items():
+                    self.put_file_id(drive_id, {'tg_file_id': tg_file_id})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        try:
+            with open(users_file, "r") as f:
+                for user_id in json.load(f):
+                    self.add_user(int(user_id))
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        self.set_meta('json_migrated', '1')
+        self.flush()
+        logging.info(f"📦 Migrated {os.path.basename(cache_file)} and {os.path.basename(users_file)} into {self.path}")
+        return True
+
+    def close(self):
+        self.flush()
+        with self.db_lock:
+            self.conn.close()